@@ -0,0 +1,262 @@
+"""
+asyncio versions of RhevResourceHandler's operations against RHEV-M.
+
+An event loop can drive any number of these operations at once: waits for VM
+state changes are served by the handler's shared status watcher and retry
+delays use asyncio.sleep, so neither ties up a thread. Only the SDK and
+database calls themselves run on threads, from a small executor whose size
+defaults to the handler's worker_pool_size. Bulk calls issue their
+requests on one connection using the SDK's non-blocking (wait=False) mode
+and then collect the responses, in batches no larger than the endpoint's
+in-flight cap.
+
+RhevOperations wraps the same operations in a blocking interface for callers
+that are not running an event loop.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from common.classes import TrueWithMessage, FalseWithMessage
+from infrastructure.models import Server
+from utilities.exceptions import CloudBoltException
+from utilities.logger import ThreadLogger
+
+from .lazy_sdk import sdk
+from .watchers import ABSENT
+
+logger = ThreadLogger(__name__)
+
+
+class AsyncRhevOperations(object):
+    """
+    Coroutine versions of the power, create, delete, NIC and inventory
+    operations of `handler`.
+
+    SDK objects are only ever created and used on the operation threads. Each
+    operation leases a connection from the handler's pool and gives it back
+    when it finishes, so idle threads hold none.
+    """
+
+    def __init__(self, handler, max_threads=None):
+        self.handler = handler
+        self.watcher = handler.status_watcher
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_threads or handler.worker_pool_size)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run the blocking callable `func` on one of the operation threads and
+        return its result.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self._call, func, args, kwargs))
+
+    def _call(self, func, args, kwargs):
+        with self.handler.releasing_connections():
+            return func(*args, **kwargs)
+
+    async def get_server(self, resource_id):
+        return await self.run(Server.objects.get, id=resource_id)
+
+    async def wait_for_vm_state(self, vm_id, states, timeout):
+        """
+        Wait up to `timeout` seconds for the VM to reach one of `states`,
+        without blocking a thread. Return the state reached, or None if the
+        wait timed out.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def reached(state):
+            loop.call_soon_threadsafe(_set_result, future, state)
+
+        waiter = self.watcher.watch(vm_id, states, reached)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.watcher.unwatch(waiter)
+            return None
+
+    async def poweron(self, resource_id, wait=False):
+        server = await self.get_server(resource_id)
+        vm_id = server.resource_handler_svr_id
+        try:
+            await self.run(lambda: self.handler.get_vm_service(vm_id).start())
+        except sdk.Error as e:
+            message = "Power on response for server {0}: {1}"
+            logger.info(message.format(resource_id, e))
+            return False
+
+        if wait:
+            return await self._wait_or_log(
+                vm_id, ["up"], "Host is not powered up after {0} seconds.")
+        return True
+
+    async def poweroff(self, resource_id):
+        server = await self.get_server(resource_id)
+        vm_id = server.resource_handler_svr_id
+        if not vm_id:
+            message = ("Could not power off server {0}: no "
+                       "resource_handler_svr_id set")
+            logger.info(message.format(server.hostname))
+            return False
+
+        try:
+            await self.run(lambda: self.handler.get_vm_service(vm_id).stop())
+        except sdk.Error as e:
+            message = "Power off response for server {0}: {1}"
+            logger.info(message.format(server.hostname, e))
+            return False
+
+        return await self._wait_or_log(
+            vm_id, ["down"], "Host is not powered down after {0} seconds.")
+
+    async def start_vms(self, vm_ids):
+        """
+        Start all of `vm_ids` with batches of concurrent requests. Return a
+        dict mapping each VM id to None on success or the sdk.Error raised.
+        """
+        return await self.run(self._send_all, vm_ids, "start")
+
+    async def stop_vms(self, vm_ids):
+        """
+        Stop all of `vm_ids`, as for start_vms().
+        """
+        return await self.run(self._send_all, vm_ids, "stop")
+
+    async def create(self, resource_id):
+        try:
+            await self.run(self.handler.create_resource, resource_id, None)
+        except CloudBoltException as e:
+            return FalseWithMessage(str(e))
+        return TrueWithMessage("Created")
+
+    async def delete(self, resource_id):
+        server = await self.get_server(resource_id)
+        vm_id = server.resource_handler_svr_id
+        if not vm_id:
+            message = ("Could not delete server {0}: no "
+                       "resource_handler_svr_id set".format(server.hostname))
+            logger.info(message)
+            return FalseWithMessage(message)
+
+        if not await self.poweroff(resource_id):
+            return FalseWithMessage("Unable to power down host.")
+
+        try:
+            await self.run(lambda: self.handler.get_vm_service(vm_id).remove())
+        except sdk.Error as e:
+            message = "Delete response for server {0}: {1}".format(
+                server.hostname, e)
+            logger.info(message)
+            return FalseWithMessage(message)
+
+        await self._wait_or_log(
+            vm_id, [ABSENT], "Server is still being removed after {0} seconds.")
+        return TrueWithMessage("Deleted")
+
+    async def add_nic(self, vm_id, nic, tries=36, delay=5):
+        """
+        Add the SDK Nic `nic` to the VM, retrying while the VM is locked.
+        Return the Nic created.
+        """
+        def add():
+            return self.handler.get_vm_service(vm_id).nics_service().add(nic)
+        return await self._retry(
+            add, tries, delay, "Add nic failed for VM {0}".format(vm_id))
+
+    async def remove_nic(self, vm_id, nic_id, tries=10, delay=5):
+        def remove():
+            nics_service = self.handler.get_vm_service(vm_id).nics_service()
+            nics_service.nic_service(nic_id).remove()
+        return await self._retry(
+            remove, tries, delay, "Delete NIC failed for VM {0}".format(vm_id))
+
+    async def list_vms(self):
+        return await self.run(self.handler.get_all_vms)
+
+    async def _wait_or_log(self, vm_id, states, message):
+        timeout = self.handler.power_timeout
+        if await self.wait_for_vm_state(vm_id, states, timeout) is None:
+            logger.info(message.format(timeout))
+            return False
+        return True
+
+    async def _retry(self, request, tries, delay, failure_message):
+        """
+        Run `request` on an operation thread, retrying up to `tries` times
+        with `delay` seconds between attempts while it raises sdk.Error.
+        """
+        while True:
+            tries -= 1
+            try:
+                return await self.run(request)
+            except sdk.Error as e:
+                if tries <= 0:
+                    logger.info(failure_message)
+                    raise CloudBoltException(failure_message)
+                logger.debug(e)
+            await asyncio.sleep(delay)
+
+    def _send_all(self, vm_ids, action):
+        vms_service = self.handler.system_service.vms_service()
+        # Each request keeps its in-flight slot at the endpoint guard until
+        # its response is collected, so send no more at once than the guard
+        # allows
+        batch_size = self.handler.endpoint_guard.max_in_flight
+        vm_ids = list(vm_ids)
+        errors = {}
+        for start in range(0, len(vm_ids), batch_size):
+            futures = []
+            try:
+                for vm_id in vm_ids[start:start + batch_size]:
+                    method = getattr(vms_service.vm_service(vm_id), action)
+                    try:
+                        futures.append((vm_id, method(wait=False)))
+                    except sdk.Error as e:
+                        errors[vm_id] = e
+            finally:
+                # Collect every response sent, even if sending the rest of
+                # the batch failed, to give back their slots
+                for vm_id, future in futures:
+                    try:
+                        future.wait()
+                        errors[vm_id] = None
+                    except sdk.Error as e:
+                        errors[vm_id] = e
+        return errors
+
+
+class RhevOperations(object):
+    """
+    Blocking facade over AsyncRhevOperations. Each coroutine method becomes
+    an ordinary method that runs it to completion on a private event loop.
+    """
+
+    def __init__(self, handler, max_threads=None):
+        self._ops = AsyncRhevOperations(handler, max_threads)
+        self._loop = asyncio.new_event_loop()
+
+    def __getattr__(self, name):
+        attr = getattr(self._ops, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            return self._loop.run_until_complete(attr(*args, **kwargs))
+        return call
+
+    def close(self):
+        self._ops.close()
+        self._loop.close()
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
@@ -0,0 +1,171 @@
+"""
+Benchmarks of the RHEV resource handler against the fake RHEV-M engine in
+tests/fake_ovirt.py, at several inventory sizes.
+
+Each benchmark is run on a new handler, so that no caches carry over, and
+prints one JSON object per line, e.g.
+
+    {"benchmark": "get_all_vms", "vms": 1000, "latency": 0.005,
+     "seconds": 0.84, "api_calls": 7, "calls_by_op": {"vms.list": 2, ...}}
+
+`seconds` is the best wall time over --repeat runs and the call counts are
+from the last run. Diff the output of two runs to spot regressions in
+either.
+
+Usage:
+    python benchmarks/bench_handler.py [--sizes 100,1000,10000]
+        [--latency SECONDS] [--clusters N] [--servers N] [--repeat N]
+        [--output FILE]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "tests"))
+
+import cloudbolt_stubs  # noqa: E402
+import fake_ovirt  # noqa: E402
+
+
+# Each benchmark does any setup that is not timed and returns the function
+# to time
+
+def bench_get_all_vms(engine, handler, servers):
+    return lambda: handler.get_all_vms(incremental=False)
+
+
+def bench_get_all_vms_incremental(engine, handler, servers):
+    # The full sync that sets the event cursor is not timed. Then as many
+    # VMs as there are servers change.
+    handler.get_all_vms(incremental=False)
+    for vm_id in list(engine.vms)[:len(servers)]:
+        engine.add_event(vm_id)
+    return lambda: handler.get_all_vms(incremental=True)
+
+
+def bench_discover_templates(engine, handler, servers):
+    return handler.discover_templates
+
+
+def bench_create_resource(engine, handler, servers):
+    def create():
+        for server in servers:
+            handler.create_resource(server.id, None)
+    return create
+
+
+def bench_create_resources(engine, handler, servers):
+    return lambda: handler.create_resources([server.id for server in servers])
+
+
+def bench_poweroff_resource(engine, handler, servers):
+    def poweroff():
+        for server in servers:
+            handler.poweroff_resource(server.id)
+    return poweroff
+
+
+def bench_poweron_resources(engine, handler, servers):
+    for server in servers:
+        handler.get_vm_service(server.resource_handler_svr_id).stop()
+    return lambda: handler.poweron_resources([server.id for server in servers])
+
+
+def bench_poweroff_resources(engine, handler, servers):
+    return lambda: handler.poweroff_resources([server.id for server in servers])
+
+
+# (name, benchmark, whether its servers need to have VMs already)
+BENCHMARKS = [
+    ("get_all_vms", bench_get_all_vms, False),
+    ("get_all_vms_incremental", bench_get_all_vms_incremental, False),
+    ("discover_templates", bench_discover_templates, False),
+    ("create_resource", bench_create_resource, False),
+    ("create_resources", bench_create_resources, False),
+    ("poweroff_resource", bench_poweroff_resource, True),
+    ("poweron_resources", bench_poweron_resources, True),
+    ("poweroff_resources", bench_poweroff_resources, True),
+]
+
+
+def prepare(engine, handler, server_count, with_vms):
+    """
+    Return `server_count` servers for `handler`, giving each a running VM if
+    `with_vms` is set
+    """
+    servers = cloudbolt_stubs.make_servers(handler, engine, server_count)
+    if with_vms:
+        cluster_id = next(iter(engine.clusters))
+        for server in servers:
+            server.resource_handler_svr_id = engine.add_vm(
+                server.hostname, cluster_id, None, status="up")
+            server.save()
+    return servers
+
+
+def run_benchmark(name, setup, with_vms, size, args):
+    best = None
+    for _ in range(args.repeat):
+        engine = fake_ovirt.FakeEngine(
+            vm_count=size, clusters=["cluster{0}".format(i)
+                                     for i in range(args.clusters)])
+        handler = cloudbolt_stubs.make_handler(
+            engine, log_api_call_summaries=False, log_trace_breakdowns=False)
+        servers = prepare(engine, handler, args.servers, with_vms)
+        func = setup(engine, handler, servers)
+
+        engine.reset_calls()
+        engine.latency = args.latency
+        start = time.time()
+        func()
+        seconds = time.time() - start
+        engine.latency = 0
+        best = seconds if best is None else min(best, seconds)
+
+    return dict(benchmark=name, vms=size, clusters=args.clusters,
+                servers=args.servers, latency=args.latency,
+                seconds=round(best, 4), api_calls=engine.call_count,
+                calls_by_op=dict(engine.calls))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="Comma-separated numbers of VMs on the engine")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds each API request takes")
+    parser.add_argument("--clusters", type=int, default=1,
+                        help="Clusters the VMs are spread over")
+    parser.add_argument("--servers", type=int, default=10,
+                        help="Servers created or powered on and off")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs of each benchmark, keeping the fastest")
+    parser.add_argument("--only", default="",
+                        help="Comma-separated benchmarks to run (default all)")
+    parser.add_argument("--output", help="File to write the results to "
+                                         "instead of stdout")
+    args = parser.parse_args(argv)
+
+    cloudbolt_stubs.load_app()
+    fake_ovirt.install()
+
+    only = set(filter(None, args.only.split(",")))
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            for name, setup, with_vms in BENCHMARKS:
+                if only and name not in only:
+                    continue
+                result = run_benchmark(name, setup, with_vms, size, args)
+                out.write(json.dumps(result, sort_keys=True) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
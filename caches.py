@@ -0,0 +1,252 @@
+"""
+In-process caches shared by every RhevResourceHandler instance that refers to
+the same handler record.
+
+CloudBolt loads a fresh handler object for each job, so anything cached on the
+instance itself would be thrown away between provisions. These caches live at
+module level instead and are looked up by the handler's primary key.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Default for LRUCache.get() that tells a cached None apart from a missing entry
+NOT_CACHED = object()
+
+
+class TemplateIndex(object):
+    """
+    Index of the templates on a RHEV-M, keyed by name and by uuid.
+
+    RHEV allows several versions of a template to share a name; the name index
+    only holds the most recently created one, which is what create_resource
+    provisions from. The whole index is rebuilt from a single template listing
+    once it is older than `ttl` seconds or has been invalidated.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_name = {}
+        self._by_uuid = {}
+        self._loaded_at = None
+
+    def is_stale(self):
+        return (self._loaded_at is None
+                or time.time() - self._loaded_at > self.ttl)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def get_by_name(self, name, load):
+        """
+        Return the latest version of the template called `name`, or None.
+
+        `load` is called with no arguments to list all templates when the
+        index needs (re)building.
+        """
+        self._refresh(load)
+        return self._by_name.get(name)
+
+    def get_by_uuid(self, uuid, load):
+        self._refresh(load)
+        return self._by_uuid.get(uuid)
+
+    def _refresh(self, load):
+        with self._lock:
+            if not self.is_stale():
+                return
+            by_name, by_uuid = {}, {}
+            for template in load():
+                by_uuid[template.id] = template
+                latest = by_name.get(template.name)
+                if latest is None or template.creation_time > latest.creation_time:
+                    by_name[template.name] = template
+            self._by_name, self._by_uuid = by_name, by_uuid
+            self._loaded_at = time.time()
+
+
+_template_indexes = {}
+_template_indexes_lock = threading.Lock()
+
+
+def get_template_index(handler_id, ttl):
+    """
+    Return the TemplateIndex for the handler with primary key `handler_id`,
+    creating it on first use.
+    """
+    with _template_indexes_lock:
+        index = _template_indexes.get(handler_id)
+        if index is None:
+            index = _template_indexes[handler_id] = TemplateIndex(ttl)
+        index.ttl = ttl
+        return index
+
+
+class InventorySnapshot(object):
+    """
+    The VMs found by the last sync of a handler, keyed by uuid, together with
+    the id of the newest engine event that sync accounted for.
+
+    Callers must hold `lock` while syncing, so that two syncs of the same
+    handler do not interleave.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.vms = {}
+        self.last_event_id = None
+        self.synced_at = None
+
+    def is_fresh(self, max_age):
+        """
+        Return whether the snapshot can be brought up to date from engine
+        events, i.e. it has an event cursor and its last full sync was less
+        than `max_age` seconds ago.
+        """
+        return (self.synced_at is not None
+                and self.last_event_id is not None
+                and time.time() - self.synced_at <= max_age)
+
+    def replace(self, vms, last_event_id):
+        """
+        Record the result of a full sync.
+        """
+        self.vms = vms
+        self.last_event_id = last_event_id
+        self.synced_at = time.time()
+
+    def update(self, changed, removed, last_event_id):
+        """
+        Record the result of an incremental sync: `changed` maps uuids to
+        new vm_dicts and `removed` is a set of uuids that are gone. Return
+        whether any VM was added, changed or removed.
+        """
+        modified = False
+        for uuid, vm_dict in changed.items():
+            old = self.vms.get(uuid)
+            if old is None or old["fingerprint"] != vm_dict["fingerprint"]:
+                self.vms[uuid] = vm_dict
+                modified = True
+        for uuid in removed:
+            if self.vms.pop(uuid, None) is not None:
+                modified = True
+        self.last_event_id = last_event_id
+        return modified
+
+
+_inventory_snapshots = {}
+_inventory_snapshots_lock = threading.Lock()
+
+
+def get_inventory_snapshot(handler_id):
+    with _inventory_snapshots_lock:
+        snapshot = _inventory_snapshots.get(handler_id)
+        if snapshot is None:
+            snapshot = _inventory_snapshots[handler_id] = InventorySnapshot()
+        return snapshot
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping holding at most `maxsize` items, discarding the
+    least recently used item when full.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            value = self._items.pop(key)
+            self._items[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_os_family_caches = {}
+_os_family_caches_lock = threading.Lock()
+
+
+def get_os_family_cache(handler_id, maxsize):
+    """
+    Return the cache of guessed OS families by template id for the handler
+    with primary key `handler_id`.
+    """
+    with _os_family_caches_lock:
+        cache = _os_family_caches.get(handler_id)
+        if cache is None:
+            cache = _os_family_caches[handler_id] = LRUCache(maxsize)
+        cache.maxsize = maxsize
+        return cache
+
+
+class VmFingerprints(object):
+    """
+    The fingerprint of each VM as last reported to CloudBolt, for working out
+    which VMs a sync actually needs to save.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+
+    def diff(self, vm_dicts):
+        """
+        Compare `vm_dicts` with the VMs last reported and record them as the
+        new last report.
+
+        Returns a 3-tuple:
+            added[]     vm_dicts for VMs not reported before
+            changed[]   vm_dicts for VMs whose fingerprint has changed
+            removed[]   uuids of reported VMs missing from `vm_dicts`
+        """
+        fingerprints = dict(
+            (vm_dict["uuid"], vm_dict["fingerprint"]) for vm_dict in vm_dicts)
+        with self._lock:
+            last = self._fingerprints
+            self._fingerprints = fingerprints
+        added = [vm_dict for vm_dict in vm_dicts if vm_dict["uuid"] not in last]
+        changed = [vm_dict for vm_dict in vm_dicts
+                   if last.get(vm_dict["uuid"], vm_dict["fingerprint"])
+                   != vm_dict["fingerprint"]]
+        removed = [uuid for uuid in last if uuid not in fingerprints]
+        return added, changed, removed
+
+    def clear(self):
+        """
+        Forget the last report, so that the next diff reports every VM as
+        added. Call this when CloudBolt failed to save a report.
+        """
+        with self._lock:
+            self._fingerprints = {}
+
+
+_vm_fingerprints = {}
+_vm_fingerprints_lock = threading.Lock()
+
+
+def get_vm_fingerprints(handler_id):
+    with _vm_fingerprints_lock:
+        fingerprints = _vm_fingerprints.get(handler_id)
+        if fingerprints is None:
+            fingerprints = _vm_fingerprints[handler_id] = VmFingerprints()
+        return fingerprints
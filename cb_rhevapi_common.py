@@ -1,7 +1,4 @@
 from builtins import object
-import ovirtsdk4.api
-import ovirtsdk4.infrastructure
-import ovirtsdk4.xml
 
 
 class TechnologyWrapper(object):
@@ -0,0 +1,262 @@
+"""
+Pooled connections to RHEV-M.
+
+One ConnectionPool exists per RHEV-M endpoint and set of credentials, keyed by
+(url, username, ca_file, verify), and is shared by every handler in the
+process that talks to that endpoint. Each thread leases its own connection,
+since an sdk.Connection cannot be used by several threads at once.
+"""
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+
+from utilities.exceptions import CloudBoltException
+from utilities.logger import ThreadLogger
+
+from .lazy_sdk import sdk
+
+logger = ThreadLogger(__name__)
+
+
+class ConnectionPool(object):
+    """
+    A bounded set of sdk.Connection objects for one RHEV-M endpoint.
+
+    Connections are handed out per thread: repeated calls to
+    get_for_current_thread() from the same thread return the same connection
+    until it is released or the thread exits. Idle connections are tested
+    before reuse once they have not been used for `health_check_interval`
+    seconds, and replaced by a fresh login if the test fails (e.g. because
+    the SSO token expired).
+    """
+
+    def __init__(self, connection_kwargs, size, health_check_interval=60,
+                 acquire_timeout=300):
+        self.connection_kwargs = connection_kwargs
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition()
+        # Idle connections, as [connection, last_used] pairs
+        self._idle = []
+        # Leased connections by thread ident, as [connection, last_used] pairs
+        self._leases = {}
+        # Connections currently checked out, leased or not
+        self._in_use = 0
+        self._closed = False
+
+    def get_for_current_thread(self):
+        """
+        Return the connection leased to the calling thread, leasing one if
+        the thread does not hold one yet.
+        """
+        ident = threading.current_thread().ident
+        with self._cond:
+            lease = self._leases.get(ident)
+        if lease is None:
+            lease = [self.acquire(), time.time()]
+            with self._cond:
+                self._leases[ident] = lease
+        elif not self._is_fresh(lease):
+            try:
+                lease[0] = self._ensure_healthy(lease[0])
+            except Exception:
+                # The old connection was closed before reconnecting failed,
+                # so drop the lease rather than leave it holding a dead
+                # connection that release would put back on the idle list
+                with self._cond:
+                    self._leases.pop(ident, None)
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        lease[1] = time.time()
+        return lease[0]
+
+    def release_current_thread(self):
+        """
+        Return the calling thread's connection (if any) to the pool.
+        """
+        ident = threading.current_thread().ident
+        with self._cond:
+            lease = self._leases.pop(ident, None)
+        if lease is not None:
+            self.release(lease[0])
+
+    def acquire(self):
+        """
+        Check out a connection, creating one if the pool has spare capacity,
+        and waiting up to `acquire_timeout` seconds for one to be released
+        otherwise.
+        """
+        deadline = time.time() + self.acquire_timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise CloudBoltException(
+                        "Connection pool for {0} is closed".format(self.url))
+                self._reap_dead_leases()
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.size:
+                    connection, last_used = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise CloudBoltException(
+                        "Timed out waiting for a connection to {0}; all {1} "
+                        "are in use".format(self.url, self.size))
+                # Wake up periodically to reclaim connections from threads
+                # that exited without releasing them
+                self._cond.wait(min(remaining, 1))
+
+        if connection is None:
+            try:
+                return self._connect()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        if time.time() - last_used > self.health_check_interval:
+            try:
+                return self._ensure_healthy(connection)
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        return connection
+
+    def release(self, connection):
+        with self._cond:
+            if self._closed:
+                closed = True
+            else:
+                closed = False
+                self._in_use -= 1
+                self._idle.append([connection, time.time()])
+                self._cond.notify()
+        if closed:
+            self._close_connection(connection)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks out a connection for the duration of the
+        block.
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def reconfigure(self, connection_kwargs, size):
+        """
+        Apply new credentials or a new size. Idle connections made with old
+        credentials are closed so that later checkouts log in again.
+        """
+        with self._cond:
+            self.size = size
+            if connection_kwargs != self.connection_kwargs:
+                self.connection_kwargs = connection_kwargs
+                stale, self._idle = self._idle, []
+            else:
+                stale = []
+            self._cond.notify_all()
+        for connection, _ in stale:
+            self._close_connection(connection)
+
+    def close(self):
+        """
+        Close every connection in the pool, including leased ones. Further
+        attempts to acquire a connection raise CloudBoltException.
+        """
+        with self._cond:
+            self._closed = True
+            connections = [c for c, _ in self._idle]
+            connections += [c for c, _ in self._leases.values()]
+            self._idle, self._leases = [], {}
+            self._in_use = 0
+            self._cond.notify_all()
+        for connection in connections:
+            self._close_connection(connection)
+
+    @property
+    def url(self):
+        return self.connection_kwargs['url']
+
+    def _is_fresh(self, lease):
+        return time.time() - lease[1] <= self.health_check_interval
+
+    def _connect(self):
+        return sdk.Connection(**self.connection_kwargs)
+
+    def _ensure_healthy(self, connection):
+        """
+        Return `connection` if it still works, otherwise close it and return
+        a newly authenticated one.
+        """
+        if connection.test(raise_exception=False):
+            return connection
+        logger.info("Reconnecting to RHEV-M at {0}".format(self.url))
+        self._close_connection(connection)
+        return self._connect()
+
+    def _reap_dead_leases(self):
+        """
+        Move connections leased to threads that have since exited back to the
+        idle list. Must be called with the lock held.
+        """
+        live = set(thread.ident for thread in threading.enumerate())
+        for ident in list(self._leases):
+            if ident not in live:
+                self._idle.append(self._leases.pop(ident))
+                self._in_use -= 1
+
+    @staticmethod
+    def _close_connection(connection):
+        try:
+            connection.close()
+        except sdk.Error as e:
+            logger.debug("Error closing RHEV-M connection: {0}".format(e))
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(connection_kwargs, size):
+    """
+    Return the pool for the endpoint and credentials in `connection_kwargs`
+    (the keyword arguments for sdk.Connection), creating it on first use.
+    """
+    key = (
+        connection_kwargs['url'],
+        connection_kwargs['username'],
+        connection_kwargs.get('ca_file'),
+        connection_kwargs.get('validate_cert_chain', True),
+    )
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(connection_kwargs, size)
+            return pool
+    pool.reconfigure(connection_kwargs, size)
+    return pool
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_all_pools)
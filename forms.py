@@ -10,7 +10,7 @@ from resourcehandlers.forms import (
 from .models import RhevResourceHandler
 from infrastructure.models import Environment
 
-from ovirtsdk4 import Connection, AuthError, ConnectionError, Error
+from .lazy_sdk import sdk
 
 
 class RhevCredentialsForm(BaseResourceHandlerCredentialsForm):
@@ -47,13 +47,13 @@ class RhevCredentialsForm(BaseResourceHandlerCredentialsForm):
                                               cert_filename))
 
             try:
-                Connection(
+                sdk.Connection(
                     url=api_url,
                     username=serviceaccount,
                     password=servicepasswd,
                     ca_file=cert_filename)
-            except (Error, ConnectionError,
-                    AuthError):
+            except (sdk.Error, sdk.ConnectionError,
+                    sdk.AuthError):
                 raise forms.ValidationError("Unable to connect to RHEV-M with"
                                             " the information provided.")
 
@@ -67,7 +67,11 @@ class RhevSettingsForm(BaseResourceHandlerSettingsForm):
         fields = (BaseResourceHandlerSettingsForm.Meta.fields
                   + ("clusterName",))
 
-    clusterName = forms.CharField(label="Cluster name")
+    clusterName = forms.CharField(
+        label="Cluster names",
+        help_text="Comma-separated. New servers are built in the first cluster.",
+        max_length=1000,
+    )
     environments = forms.ModelMultipleChoiceField(
         queryset=Environment.objects.exclude(name="Unassigned"),
         required=False,
@@ -0,0 +1,279 @@
+"""
+Counting and timing of the calls RhevResourceHandler makes to RHEV-M.
+
+Handlers reach every SDK service through InstrumentedService, which records
+the latency and outcome of each call in the handler's CallStats under an
+operation name derived from the service path, e.g. 'vms.list' or
+'vms.vm.nics.add'.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from utilities.logger import ThreadLogger
+
+logger = ThreadLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_local = threading.local()
+_collectors_lock = threading.Lock()
+
+
+class CallStats(object):
+    """
+    Call counts, error counts and latency histograms per operation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def record(self, op, elapsed, error=False):
+        with self._lock:
+            stats = self._ops.get(op)
+            if stats is None:
+                stats = self._ops[op] = dict(
+                    count=0, errors=0, total_seconds=0.0, max_seconds=0.0,
+                    histogram=[0] * (len(LATENCY_BUCKETS) + 1))
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["total_seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+            bucket = len(LATENCY_BUCKETS)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    bucket = i
+                    break
+            stats["histogram"][bucket] += 1
+
+        collectors = getattr(_local, "collectors", ())
+        if collectors:
+            with _collectors_lock:
+                for collector in collectors:
+                    collector[op] = collector.get(op, 0) + 1
+
+    def snapshot(self):
+        """
+        Return a dict mapping each operation name to a dict of its count,
+        errors, total_seconds, max_seconds and histogram. The histogram maps
+        bucket labels such as '<=0.5' or '>30' to call counts.
+        """
+        labels = ["<={0}".format(bound) for bound in LATENCY_BUCKETS]
+        labels.append(">{0}".format(LATENCY_BUCKETS[-1]))
+        with self._lock:
+            return dict(
+                (op, dict(stats, histogram=dict(zip(labels, stats["histogram"]))))
+                for op, stats in self._ops.items())
+
+    def totals(self):
+        """
+        Return (calls, errors, total seconds) across all operations.
+        """
+        with self._lock:
+            return (sum(s["count"] for s in self._ops.values()),
+                    sum(s["errors"] for s in self._ops.values()),
+                    sum(s["total_seconds"] for s in self._ops.values()))
+
+    def reset(self):
+        with self._lock:
+            self._ops = {}
+
+
+class InstrumentedService(object):
+    """
+    Wraps an SDK service so that every request made through it, or through
+    any service reached from it, is recorded in `stats`.
+
+    If `guard` (a throttling.EndpointGuard) is given, each request is also
+    made within guard.call(); time spent waiting for the guard is not
+    counted as latency. A request sent with wait=False holds its place in
+    the guard until its future is waited on, so that the in-flight cap and
+    circuit breaker see it until the engine answers. Callers must wait on
+    every such future.
+    """
+
+    def __init__(self, service, stats, path="", guard=None):
+        self._service = service
+        self._stats = stats
+        self._path = path
+        self._guard = guard
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if not callable(attr):
+            return attr
+
+        if name.endswith("_service"):
+            # Locating a sub-service is local; wrap what it returns
+            child_path = _join(self._path, name[:-len("_service")])
+
+            def locate(*args, **kwargs):
+                return InstrumentedService(attr(*args, **kwargs), self._stats,
+                                           child_path, self._guard)
+            return locate
+
+        op = _join(self._path, name)
+
+        def call(*args, **kwargs):
+            if self._guard is None:
+                return self._timed(op, attr, args, kwargs)
+            if kwargs.get("wait", True) is False:
+                return self._send(op, attr, args, kwargs)
+            with self._guard.call():
+                return self._timed(op, attr, args, kwargs)
+        return call
+
+    def _send(self, op, method, args, kwargs):
+        self._guard.acquire()
+        start = time.time()
+        try:
+            future = method(*args, **kwargs)
+        except Exception as e:
+            self._guard.release(e)
+            self._stats.record(op, time.time() - start, True)
+            raise
+        return _GuardedFuture(future, self._guard, self._stats, op, start)
+
+    def _timed(self, op, method, args, kwargs):
+        start = time.time()
+        error = False
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._stats.record(op, time.time() - start, error)
+
+
+class _GuardedFuture(object):
+    """
+    The future of a request sent with wait=False, which records the
+    request's latency and outcome and releases its guard once it is waited
+    on.
+    """
+
+    def __init__(self, future, guard, stats, op, start):
+        self._future = future
+        self._guard = guard
+        self._stats = stats
+        self._op = op
+        self._start = start
+        self._done = False
+
+    def wait(self):
+        try:
+            result = self._future.wait()
+        except Exception as e:
+            self._finish(e)
+            raise
+        self._finish(None)
+        return result
+
+    def _finish(self, error):
+        if self._done:
+            return
+        self._done = True
+        self._guard.release(error)
+        self._stats.record(self._op, time.time() - self._start, error is not None)
+
+
+@contextmanager
+def collect_calls():
+    """
+    Context manager yielding a dict that counts, by operation name, the
+    instrumented calls the current thread makes inside the block.
+    """
+    counts = {}
+    collectors = getattr(_local, "collectors", None)
+    if collectors is None:
+        collectors = _local.collectors = []
+    collectors.append(counts)
+    try:
+        yield counts
+    finally:
+        # Nested collectors can hold equal counts, so remove this one by
+        # identity rather than with list.remove()
+        for i, collector in enumerate(collectors):
+            if collector is counts:
+                del collectors[i]
+                break
+
+
+def current_collectors():
+    """
+    Return the call collectors active on the current thread, for passing to
+    sharing_collectors() in worker threads started on its behalf.
+    """
+    return list(getattr(_local, "collectors", ()))
+
+
+@contextmanager
+def sharing_collectors(collectors):
+    """
+    Context manager that makes the calls of the current (worker) thread
+    count towards `collectors`, as returned by current_collectors() on the
+    thread the work is being done for.
+    """
+    previous = getattr(_local, "collectors", None)
+    _local.collectors = list(collectors)
+    try:
+        yield
+    finally:
+        _local.collectors = previous
+
+
+def format_call_counts(counts):
+    """
+    Render a dict of call counts by operation as a compact, sorted string,
+    e.g. '3 calls (vms.list=2, templates.template.get=1)'.
+    """
+    total = sum(counts.values())
+    details = ", ".join("{0}={1}".format(op, counts[op]) for op in sorted(counts))
+    return "{0} calls ({1})".format(total, details) if total else "0 calls"
+
+
+def summarize_api_calls(description):
+    """
+    Decorator for handler methods that logs one line counting the RHEV-M
+    calls made by the method on the calling thread, when the handler's
+    `log_api_call_summaries` is set.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(handler, *args, **kwargs):
+            if not handler.log_api_call_summaries:
+                return method(handler, *args, **kwargs)
+            start = time.time()
+            with collect_calls() as counts:
+                try:
+                    return method(handler, *args, **kwargs)
+                finally:
+                    logger.info("{0} on {1} took {2:.1f}s and made {3}".format(
+                        description, handler, time.time() - start,
+                        format_call_counts(counts)))
+        return wrapper
+    return decorator
+
+
+def _join(path, name):
+    return "{0}.{1}".format(path, name) if path else name
+
+
+_call_stats = {}
+_call_stats_lock = threading.Lock()
+
+
+def get_call_stats(key):
+    """
+    Return the CallStats for `key` (a handler's primary key), creating it on
+    first use.
+    """
+    with _call_stats_lock:
+        stats = _call_stats.get(key)
+        if stats is None:
+            stats = _call_stats[key] = CallStats()
+        return stats
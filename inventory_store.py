@@ -0,0 +1,111 @@
+"""
+On-disk copy of each handler's last inventory, shared between processes.
+
+Sync jobs write what they fetched from RHEV-M; any CloudBolt process can then
+read it back without contacting the engine, as long as it is recent enough.
+Each handler has a directory holding one gzipped JSON file per kind of
+inventory ('vms', 'networks', 'templates'), so that reading or writing one
+section never touches the others. A file's modification time is when its
+section was last fetched. Files are replaced atomically, so neither readers
+nor writers need a lock.
+"""
+import gzip
+import json
+import os
+import tempfile
+import time
+
+from utilities.logger import ThreadLogger
+
+logger = ThreadLogger(__name__)
+
+# Items encoded before each write to the gzip file
+WRITE_BATCH = 500
+
+
+class InventoryStore(object):
+    """
+    The inventory files in `directory`. Values JSON cannot represent, such
+    as model instances, are stored as `default(value)`.
+    """
+
+    def __init__(self, directory, default=str):
+        self.directory = directory
+        self.default = default
+
+    def path(self, section):
+        return os.path.join(self.directory, "{0}.json.gz".format(section))
+
+    def read(self, section, max_age):
+        """
+        Return the stored items for `section`, or None if there are none or
+        they were fetched more than `max_age` seconds ago.
+        """
+        fetched_at = self.fetched_at(section)
+        if fetched_at is None or time.time() - fetched_at > max_age:
+            return None
+        try:
+            with gzip.open(self.path(section), "rb") as f:
+                return json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def fetched_at(self, section):
+        """
+        Return when `section` was last stored, as a Unix timestamp, or None.
+        """
+        try:
+            return os.path.getmtime(self.path(section))
+        except OSError:
+            return None
+
+    def touch(self, section):
+        """
+        Mark the stored `section` as fetched now, for a sync that found
+        nothing had changed. Failures are logged rather than raised.
+        """
+        try:
+            os.utime(self.path(section), None)
+        except OSError as e:
+            logger.info("Could not update RHEV inventory at {0}: {1}".format(
+                self.path(section), e))
+
+    def write(self, section, items):
+        """
+        Store `items` (a list of dicts) as `section`. Failures are logged
+        rather than raised, since the store is only a cache.
+        """
+        path = self.path(section)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(fd, "wb") as raw:
+                    with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                        self._write_items(f, items)
+                os.rename(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except (IOError, OSError, TypeError, ValueError) as e:
+            logger.info("Could not save RHEV inventory to {0}: {1}".format(
+                path, e))
+
+    def _write_items(self, f, items):
+        # Encode the items one at a time and write the separators between
+        # them. Each item goes through the C encoder in one call (json.dump()
+        # to a file uses the pure-Python encoder and writes each token
+        # separately, which is several times slower), and only WRITE_BATCH
+        # of them are held as text at once.
+        encode = json.JSONEncoder(separators=(",", ":"), default=self.default).encode
+        chunk = ["["]
+        for index, item in enumerate(items):
+            if index:
+                chunk.append(",")
+            chunk.append(encode(item))
+            if len(chunk) >= 2 * WRITE_BATCH:
+                f.write("".join(chunk).encode("utf-8"))
+                chunk = []
+        chunk.append("]")
+        f.write("".join(chunk).encode("utf-8"))
@@ -0,0 +1,33 @@
+"""
+Deferred import of the oVirt SDK.
+
+Importing ovirtsdk4 pulls in pycurl and the SDK's generated types, readers
+and writers, which every CloudBolt process would otherwise pay for when the
+rhev app is loaded, whether or not it ever talks to RHEV. Modules in this app
+use `sdk` and `types` from here instead of importing ovirtsdk4; the real
+module is imported the first time one of its attributes is used.
+"""
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stand-in for the module `name` that imports it on first attribute access.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def is_loaded(self):
+        return self._module is not None
+
+
+sdk = LazyModule("ovirtsdk4")
+types = LazyModule("ovirtsdk4.types")
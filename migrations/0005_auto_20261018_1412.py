@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 14:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rhev', '0004_auto_20180503_1800'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rhevresourcehandler',
+            name='clusterName',
+            field=models.CharField(default='', max_length=1000),
+        ),
+    ]
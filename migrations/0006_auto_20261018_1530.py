@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 15:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rhev', '0005_auto_20261018_1412'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rhevosbuildattribute',
+            name='cpu_cnt',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rhevosbuildattribute',
+            name='mem_size',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='rhevosbuildattribute',
+            name='template_version',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='rhevosbuildattribute',
+            name='total_disk_size',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
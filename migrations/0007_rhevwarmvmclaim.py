@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 16:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rhev', '0006_auto_20261018_1530'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RhevWarmVmClaim',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vm_id', models.CharField(max_length=36, unique=True)),
+                ('claimed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'RHEV Warm VM Claim',
+            },
+        ),
+    ]
@@ -1,26 +1,106 @@
 from __future__ import division
 
+import hashlib
+import itertools
+import json
 import os
+import threading
 import time
-
-from django.db import models
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal
+from uuid import uuid4
+
+from django import db
+from django.db import models, transaction
 from django.utils.encoding import python_2_unicode_compatible
 
 from common.classes import TrueWithMessage, FalseWithMessage
-from externalcontent.models import OSBuildAttribute
+from externalcontent.models import OSBuildAttribute, OSFamily
 from infrastructure.models import Server, ServerNetworkCard
 from resourcehandlers.models import ResourceHandler, ResourceNetwork
 from settings import VARDIR
 from utilities.exceptions import CloudBoltException
 from utilities.logger import ThreadLogger
 
-import ovirtsdk4 as sdk
-import ovirtsdk4.types as types
+from .caches import (
+    NOT_CACHED, get_inventory_snapshot, get_os_family_cache, get_template_index,
+    get_vm_fingerprints,
+)
+from .connections import get_connection_pool
+from .instrumentation import (
+    InstrumentedService, current_collectors, get_call_stats, sharing_collectors,
+    summarize_api_calls,
+)
+from .inventory_store import InventoryStore
+from .lazy_sdk import sdk, types
+from .pipeline import ProvisioningPipeline
+from .throttling import get_endpoint_guard
+from .tracing import adopting_span, current_span, get_traces, trace_span, traced
+from .warm_pool import get_warm_pool, is_warm_vm
+from .watchers import ABSENT, VM_UNLOCKED_STATES, get_vm_status_watcher
 
 logger = ThreadLogger(__name__)
 
 ONE_GIG = 2 ** 30
 
+# Links followed when listing VMs for inventory, so that disks and NICs come
+# back in the same response instead of costing one request per VM each.
+VM_INVENTORY_LINKS = "disk_attachments.disk,nics"
+
+# RhevOSBuildAttribute fields describing the size of a template
+TEMPLATE_SIZING_FIELDS = ("total_disk_size", "cpu_cnt", "mem_size", "template_version")
+
+
+def dictify_template(t):
+    """
+    Return the dict describing a template (or VM) that guess_os_family
+    expects.
+    """
+    return dict(name=t.name, uuid=t.id, description=t.os.type)
+
+
+def get_inventory_key(value):
+    """
+    Return what is saved in the inventory store, and hashed in VM
+    fingerprints, in place of a value JSON cannot represent: an OSFamily's
+    name, or the text of anything else, such as a Decimal.
+    """
+    if isinstance(value, OSFamily):
+        return value.name
+    return str(value)
+
+
+def get_vm_fingerprint(vm_dict):
+    """
+    Return a hash of the synced fields of a vm_dict, which changes whenever
+    any of them does. The os_family is hashed by name, so a vm_dict read
+    back from the inventory store hashes the same.
+    """
+    fields = dict((key, value) for key, value in vm_dict.items()
+                  if key != "fingerprint")
+    return hashlib.sha1(json.dumps(
+        fields, sort_keys=True, default=get_inventory_key).encode("utf-8")).hexdigest()
+
+
+def get_template_sizing(t):
+    """
+    Return the values of TEMPLATE_SIZING_FIELDS for an SDK template fetched
+    with its disk attachments followed.
+    """
+    total_disk = sum(attachment.disk.provisioned_size or 0
+                     for attachment in t.disk_attachments or [])
+    version = "{0}:{1}".format(
+        t.version.version_number if t.version else "",
+        t.creation_time.isoformat() if t.creation_time else "")
+    return dict(
+        total_disk_size=int(total_disk / ONE_GIG),
+        cpu_cnt=t.cpu.topology.sockets * t.cpu.topology.cores,
+        mem_size=Decimal(t.memory or 0) / ONE_GIG,
+        template_version=version,
+    )
+
 
 class RhevNetwork(ResourceNetwork):
     """
@@ -38,6 +118,15 @@ class RhevOSBuildAttribute(OSBuildAttribute):
     old_template_name = models.CharField(max_length=100)
     uuid = models.CharField(max_length=100)
 
+    # Sizing saved by discover_templates so that the Images tab and cost
+    # estimates don't need to ask RHEV. Sizes are in GB.
+    total_disk_size = models.IntegerField(null=True, blank=True)
+    cpu_cnt = models.IntegerField(null=True, blank=True)
+    mem_size = models.DecimalField(max_digits=10, decimal_places=2,
+                                   null=True, blank=True)
+    # Identifies the template version the sizing was read from
+    template_version = models.CharField(max_length=100, blank=True, default="")
+
     def __str__(self):
         return self.template_name
 
@@ -45,6 +134,18 @@ class RhevOSBuildAttribute(OSBuildAttribute):
         verbose_name = "RHEV OS Build Attribute"
 
 
+class RhevWarmVmClaim(models.Model):
+    """
+    Records that a warm pool VM has been handed out. vm_id is unique, so
+    only one CloudBolt process can claim each VM.
+    """
+    vm_id = models.CharField(max_length=36, unique=True)
+    claimed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "RHEV Warm VM Claim"
+
+
 class RhevResourceHandler(ResourceHandler):
     """
     This class extends the ResourceHandler class to include
@@ -52,20 +153,102 @@ class RhevResourceHandler(ResourceHandler):
     """
     cert_directory = os.path.join(VARDIR, "opt/cloudbolt/rhev")
 
-    clusterName = models.CharField(max_length=100, default="")
+    # Comma-separated names of the clusters this handler manages
+    clusterName = models.CharField(max_length=1000, default="")
     can_sync_vms = True
     networks = models.ManyToManyField(RhevNetwork, blank=True)
     old_os_build_attributes = models.ManyToManyField(RhevOSBuildAttribute, blank=True)
     type_name = "RHEV"
+    # Seconds before the template index is rebuilt from a fresh listing
+    template_index_ttl = 15 * 60
+
+    # Maximum number of concurrent connections to this handler's RHEV-M
+    connection_pool_size = 8
+    # Seconds to wait for a VM to power on, power off or be removed
+    power_timeout = 120
+    # Seconds to wait for a new VM's disks to finish copying from its template
+    image_lock_timeout = 30 * 60
+    # VMs on one host that bulk power operations change state at once
+    power_concurrency_per_host = 10
+    # Whether VM syncs only re-read the VMs that engine events say changed
+    incremental_vm_sync = True
+    # Seconds after a full VM sync before the next sync must be a full one
+    incremental_sync_max_age = 60 * 60
+    # More events than this since the last sync forces a full VM sync
+    incremental_sync_max_events = 2000
+    # Seconds for which inventory saved by any process is used in preference
+    # to asking RHEV
+    inventory_max_age = 5 * 60
+    # Number of VMs read per request when enumerating the cluster
+    vm_page_size = 500
+    # Number of templates whose guessed OS family is remembered
+    os_family_cache_size = 1000
+    # Log one summary of RHEV-M calls per sync/provision/delete instead of a
+    # line per VM
+    log_api_call_summaries = True
+    # Log a timing breakdown to the job log after each provisioning, NIC,
+    # power off and delete step
+    log_trace_breakdowns = True
+    # Requests per second, and the burst above that, allowed to one RHEV-M
+    # from this process
+    api_rate_limit = 20
+    api_burst = 40
+    # Requests allowed in flight to one RHEV-M at once from this process
+    api_max_in_flight = 16
+    # Consecutive engine failures after which calls fail fast, and seconds
+    # before a probe request is let through again
+    circuit_failure_threshold = 5
+    circuit_reset_timeout = 30
+    # NIC changes made on one VM at once
+    nic_change_concurrency = 4
+    # Powered-off VMs to keep cloned from each template that servers are
+    # built from, ready to be handed out instead of cloning; 0 disables it
+    warm_pool_size = 0
 
-    _api = []
+    @property
+    def connection_pool(self):
+        return get_connection_pool(self.get_connection_kwargs(),
+                                   self.connection_pool_size)
 
     @property
     def api(self):
-        # Immediately return the cached API instance if it exists
-        if self._api:
-            return self._api[0]
+        """
+        The connection leased to the calling thread from this handler's
+        connection pool.
+        """
+        return self.connection_pool.get_for_current_thread()
+
+    def release_connection(self):
+        """
+        Give the calling thread's connection back to the pool. Worker threads
+        that outlive a single operation should call this when they are done.
+        """
+        self.connection_pool.release_current_thread()
+
+    @property
+    def worker_pool_size(self):
+        """
+        The number of worker threads bulk operations use by default: the
+        connection pool size, less a connection each for the thread that
+        started the operation and for the status watcher.
+        """
+        return max(1, self.connection_pool_size - 2)
 
+    @contextmanager
+    def releasing_connections(self):
+        """
+        Context manager for work done on a pool thread on behalf of another
+        thread. Worker threads outlive each piece of work, so the RHEV-M and
+        database connections the block used are handed back when it ends
+        rather than held by an idle thread.
+        """
+        try:
+            yield
+        finally:
+            self.release_connection()
+            db.connection.close()
+
+    def get_connection_kwargs(self):
         api_kwargs = {
             'url': self.get_api_url(self.protocol, self.ip, self.port),
             'username': self.serviceaccount,
@@ -80,9 +263,77 @@ class RhevResourceHandler(ResourceHandler):
         if should_verify_ssl is False:
             api_kwargs['validate_cert_chain'] = False
 
-        api = sdk.Connection(**api_kwargs)
-        self._api.append(api)
-        return api
+        return api_kwargs
+
+    @property
+    def system_service(self):
+        """
+        The root SDK service, instrumented so that every call made through it
+        is recorded in this handler's call_stats.
+        """
+        return InstrumentedService(self.api.system_service(), self.call_stats,
+                                   guard=self.endpoint_guard)
+
+    @property
+    def endpoint_guard(self):
+        """
+        The rate limiter and circuit breaker shared by every handler talking
+        to this handler's RHEV-M.
+        """
+        return get_endpoint_guard(
+            self.get_api_url(self.protocol, self.ip, self.port),
+            self.api_rate_limit, self.api_burst, self.api_max_in_flight,
+            self.circuit_failure_threshold, self.circuit_reset_timeout)
+
+    @property
+    def call_stats(self):
+        return get_call_stats(self.id)
+
+    def get_api_call_stats(self):
+        """
+        Return the counts, errors and latency histograms of the RHEV-M calls
+        made so far by this handler, and by the status watcher polling on
+        behalf of all handlers for the same RHEV-M, by operation name.
+        """
+        return dict(handler=self.call_stats.snapshot(),
+                    status_watcher=self.status_watcher.stats.snapshot())
+
+    def get_recent_traces(self, name=None):
+        """
+        Return the timing breakdowns of this handler's recent jobs in this
+        process, oldest first. Each is a dict of the span's name, tags,
+        start, duration, calls, calls_by_op, retries, error and children
+        (dicts of the same form).
+
+        `name`: Only return traces of this method, e.g. 'create_resource'
+        """
+        return [span.to_dict() for span in list(get_traces(self.id))
+                if name is None or span.name == name]
+
+    def get_vm_service(self, vm_id):
+        return self.system_service.vms_service().vm_service(vm_id)
+
+    @property
+    def status_watcher(self):
+        return get_vm_status_watcher(self.connection_pool, self.endpoint_guard)
+
+    def wait_for_vm_state(self, vm_id, states, timeout):
+        """
+        Wait up to `timeout` seconds for the VM to reach one of `states`.
+        Return the state reached, or None if the wait timed out.
+
+        Waits are served by the shared status watcher for this RHEV-M, so
+        any number of concurrent waits cost one request per poll.
+        """
+        return self.status_watcher.wait_for(vm_id, states, timeout)
+
+    def get_async_operations(self, max_threads=None):
+        """
+        Return an AsyncRhevOperations for driving many operations on this
+        handler from an asyncio event loop.
+        """
+        from .aio import AsyncRhevOperations
+        return AsyncRhevOperations(self, max_threads)
 
     @classmethod
     def get_api_url(cls, protocol, ip, port):
@@ -93,9 +344,46 @@ class RhevResourceHandler(ResourceHandler):
         filename = "{0}:{1}-ca.crt".format(ip, port)
         return os.path.join(cls.cert_directory, filename)
 
-    def __init__(self, *args, **kwargs):
-        super(RhevResourceHandler, self).__init__(*args, **kwargs)
-        self.cluster_query = 'cluster="{0}"'.format(self.clusterName)
+    @property
+    def cluster_names(self):
+        """
+        The names of the clusters this handler manages, from the
+        comma-separated clusterName. New VMs are created in the first one.
+        """
+        return [name.strip() for name in self.clusterName.split(",")
+                if name.strip()]
+
+    @property
+    def default_cluster_name(self):
+        names = self.cluster_names
+        return names[0] if names else ""
+
+    @staticmethod
+    def get_cluster_query(cluster_name):
+        return 'cluster="{0}"'.format(cluster_name)
+
+    def map_clusters(self, func):
+        """
+        Call func(cluster_name) for each of this handler's clusters
+        concurrently and return the results in the same order as
+        cluster_names.
+
+        `func` runs on worker threads, so it must get any SDK services it
+        uses from self.system_service itself rather than share the caller's.
+        """
+        names = self.cluster_names
+        if len(names) <= 1:
+            return [func(name) for name in names]
+
+        collectors = current_collectors()
+
+        def call(name):
+            with self.releasing_connections(), sharing_collectors(collectors):
+                return func(name)
+
+        workers = min(len(names), self.connection_pool_size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(call, names))
 
     def verify_connection(self):
         """
@@ -104,20 +392,30 @@ class RhevResourceHandler(ResourceHandler):
         # This method is required on all RHs.  Currently this does nothing to verify the
         # credentials or connetion to RHEV; however, forms.RhevCredentialsForm does.
 
-    def poweron_resource(self, resource_id, pxe=None):
+    def poweron_resource(self, resource_id, pxe=None, wait=False):
         """
         Powers on the server specified by resource_id
+
+        `wait`: Block until RHEV reports the VM as up (for at most
+        `power_timeout` seconds), returning False if it never gets there
         """
         server = Server.objects.get(id=resource_id)
+        vm_id = server.resource_handler_svr_id
         try:
-            vm = self.api.vms_service(id=server.resource_handler_svr_id)
-            vm.start()
-        except Error as e:
+            self.get_vm_service(vm_id).start()
+        except sdk.Error as e:
             message = "Power on response for server {0}: {1}"
-            logger.info(message.format(resource_id, e.detail))
+            logger.info(message.format(resource_id, e))
+            return False
+
+        if wait and self.wait_for_vm_state(vm_id, ["up"], self.power_timeout) is None:
+            message = "Host is not powered up after {0} seconds."
+            logger.info(message.format(self.power_timeout))
             return False
+
         return True
 
+    @traced("poweroff_resource")
     def poweroff_resource(self, resource_id):
         """
         Powers off the server specified by resource_id
@@ -131,52 +429,179 @@ class RhevResourceHandler(ResourceHandler):
             logger.info(message.format(server.hostname))
             return False
 
+        vm_id = server.resource_handler_svr_id
         try:
-            vm = self.api.vms.get(id=server.resource_handler_svr_id)
-            vm.stop()
+            with trace_span("stop vm"):
+                self.get_vm_service(vm_id).stop()
 
         except sdk.Error as e:
             message = "Power off response for server {0}: {1}"
-            logger.info(message.format(server.hostname, e.detail))
+            logger.info(message.format(server.hostname, e))
             return False
 
-        # Give it 2 minutes to shut down, continually checking the state.
-        is_up = True
-        t_end = time.time() + 120
-        while time.time() < t_end:
-            #  Continually refresh the object...
-            vm = self.api.vms.get(id=server.resource_handler_svr_id)
-            if vm.status.state == 'down':
-                is_up = False
-                break
-
-        if is_up:
-            message = "Host is not powered down after 2 minutes."
-            logger.info(message)
+        # Give it a couple of minutes to shut down
+        with trace_span("wait for down"):
+            state = self.wait_for_vm_state(vm_id, ["down"], self.power_timeout)
+        if state is None:
+            message = "Host is not powered down after {0} seconds."
+            logger.info(message.format(self.power_timeout))
             return False
 
         return True
 
+    def poweron_resources(self, resource_ids, per_host=None):
+        """
+        Powers on all the servers specified by resource_ids, with at most
+        `per_host` (default `power_concurrency_per_host`) starts in progress
+        at once on each host, and waits for them to come up.
+
+        Returns a dict mapping each resource_id to a TrueWithMessage if the
+        server came up or a FalseWithMessage saying why not.
+        """
+        return self._power_resources(resource_ids, "start", "up", per_host)
+
+    def poweroff_resources(self, resource_ids, per_host=None):
+        """
+        Powers off all the servers specified by resource_ids, as for
+        poweron_resources().
+        """
+        return self._power_resources(resource_ids, "stop", "down", per_host)
+
+    def _power_resources(self, resource_ids, action, target_state, per_host):
+        """
+        Call `action` ('start' or 'stop') on the VMs of resource_ids in
+        staggered waves: the VMs are grouped by the host they run on (or
+        their cluster, if not running), each group has at most `per_host`
+        VMs in transition at a time, and as soon as one VM in a group reaches
+        `target_state` the next VM in that group is sent the action.
+        """
+        per_host = per_host or self.power_concurrency_per_host
+        results = {}
+        vm_ids = {}
+        for server in Server.objects.filter(id__in=resource_ids):
+            if server.resource_handler_svr_id:
+                vm_ids[server.id] = server.resource_handler_svr_id
+            else:
+                results[server.id] = FalseWithMessage(
+                    "Could not {0} server {1}: no resource_handler_svr_id "
+                    "set".format(action, server.hostname))
+        for resource_id in resource_ids:
+            if resource_id not in vm_ids and resource_id not in results:
+                results[resource_id] = FalseWithMessage(
+                    "Could not {0} server {1}: it does not exist".format(
+                        action, resource_id))
+
+        # One batched lookup finds where every VM runs and skips any that are
+        # already in the target state
+        api_vms = dict((vm_obj.id, vm_obj)
+                       for vm_obj in self.list_vms_by_id(vm_ids.values()))
+        queues = {}
+        for resource_id, vm_id in vm_ids.items():
+            vm_obj = api_vms.get(vm_id)
+            if vm_obj is None:
+                results[resource_id] = FalseWithMessage(
+                    "VM {0} not found in RHEV".format(vm_id))
+            elif vm_obj.status.value == target_state:
+                results[resource_id] = TrueWithMessage(
+                    "Already {0}".format(target_state))
+            else:
+                group = vm_obj.host.id if vm_obj.host else vm_obj.cluster.id
+                queues.setdefault(group, deque()).append(resource_id)
+
+        watcher = self.status_watcher
+        cond = threading.Condition()
+        reached = []
+        in_flight = {}
+
+        def launch(group):
+            queue = queues[group]
+            while queue and len([g for g, _, _ in in_flight.values()
+                                 if g == group]) < per_host:
+                resource_id = queue.popleft()
+                vm_id = vm_ids[resource_id]
+                try:
+                    getattr(self.get_vm_service(vm_id), action)()
+                except sdk.Error as e:
+                    results[resource_id] = FalseWithMessage(
+                        "Power {0} response for VM {1}: {2}".format(action, vm_id, e))
+                    continue
+
+                def callback(state, resource_id=resource_id):
+                    with cond:
+                        reached.append(resource_id)
+                        cond.notify()
+                waiter = watcher.watch(vm_id, [target_state], callback)
+                in_flight[resource_id] = (
+                    group, waiter, time.time() + self.power_timeout)
+
+        try:
+            for group in queues:
+                launch(group)
+
+            while in_flight:
+                with cond:
+                    if not reached:
+                        cond.wait(1)
+                    done, reached[:] = list(reached), []
+
+                now = time.time()
+                for resource_id, (group, waiter, deadline) in list(in_flight.items()):
+                    if resource_id in done:
+                        results[resource_id] = TrueWithMessage(target_state.capitalize())
+                    elif now > deadline:
+                        watcher.unwatch(waiter)
+                        results[resource_id] = FalseWithMessage(
+                            "VM {0} not {1} after {2} seconds".format(
+                                vm_ids[resource_id], target_state, self.power_timeout))
+                    else:
+                        continue
+                    del in_flight[resource_id]
+                    launch(group)
+        finally:
+            # If a request raised (e.g. CircuitOpenError), stop watching the
+            # VMs still in transition
+            for group, waiter, deadline in in_flight.values():
+                watcher.unwatch(waiter)
+
+        return results
+
+    @traced("configure_network")
     def configure_network(self, resource_id, job=None):
         server = Server.objects.get(id=resource_id)
 
-        # try to power on for three minutes
-        tries = 36
-        while tries > 0 and not self.poweron_resource(resource_id):
-            tries -= 1
-            time.sleep(5)
-
-        if tries == 0:
+        # The VM cannot be started until its disks have finished copying from
+        # the template, so wait for the image lock to clear before powering
+        # on. If the copy fails the engine removes the VM.
+        with trace_span("wait for disks"):
+            state = self.wait_for_vm_state(
+                server.resource_handler_svr_id, VM_UNLOCKED_STATES + (ABSENT,),
+                self.image_lock_timeout)
+
+        powered_on = False
+        if state == ABSENT:
+            logger.info("VM for server {0} was removed while its disks were "
+                        "copying".format(server.hostname))
+        elif state is not None:
+            with trace_span("power on"):
+                powered_on = self.poweron_resource(resource_id, wait=True)
+
+        if not powered_on:
             message = "Power on failed for server {0}".format(server.hostname)
             logger.info(message)
             # TODO: set server to powered off state in cloudbolt
 
+    @traced("add_nics_to_server")
     def add_nics_to_server(self, resource_id, delete_first=True):
         """
         Adds NICs to the server specified by resource_id.
 
+        The VM's current NICs are reconciled against the server's networks:
+        NICs already on the right network are left alone, NICs on the wrong
+        network are moved, missing NICs are added, and the changes are all
+        made concurrently.
+
         `delete_first`: Indicates that any NICs already associated with the
-        server should be removed before new ones are added
+        server beyond those for its networks should be removed
         """
         server = Server.objects.get(id=resource_id)
 
@@ -186,81 +611,174 @@ class RhevResourceHandler(ResourceHandler):
                 "No networks found! At least one is needed to build a "
                 "server using this Resource Handler ({0})".format(self))
 
-        vm_obj = self.api.vms.get(id=server.resource_handler_svr_id)
-        cluster_obj = self.api.clusters.get(name=self.clusterName)
+        vm_id = server.resource_handler_svr_id
+        with trace_span("list nics"):
+            current_nics = dict((nic_obj.name, nic_obj) for nic_obj in
+                                self.get_vm_service(vm_id).nics_service().list())
+        with trace_span("get vnic profiles"):
+            profile_ids = self.get_vnic_profile_ids()
+
+        # Work out what needs to change on the VM
+        desired = []
+        changes = []
+        # The MACs of the NICs that are kept, for those that are not changed
+        kept_macs = {}
+        for index, network in enumerate(server_net_list):
+            mac, ip = server.get_mac_ip(index)
+            nic_name = "nic{0}".format(index + 1)
+            desired.append((index, nic_name, network, mac, ip))
+
+            profile_id = profile_ids.get(network.uuid)
+            if profile_id is None:
+                raise CloudBoltException(
+                    "No vNIC profile found for network {0} when adding NICs "
+                    "to server {1}".format(network, server.hostname))
+            profile = types.VnicProfile(id=profile_id)
+
+            nic_obj = current_nics.pop(nic_name, None)
+            if nic_obj is not None and nic_obj.mac is not None:
+                kept_macs[nic_name] = nic_obj.mac.address
+            if nic_obj is None:
+                nic_obj = types.Nic(
+                    name=nic_name,
+                    interface=types.NicInterface.VIRTIO,
+                    vnic_profile=profile,
+                    mac=types.Mac(address=mac) if mac else None,
+                )
+                changes.append((nic_name, "add", nic_obj))
+            elif not nic_obj.vnic_profile or nic_obj.vnic_profile.id != profile_id:
+                changes.append((nic_name, "update",
+                                types.Nic(id=nic_obj.id, vnic_profile=profile)))
+            else:
+                logger.debug("NIC {0} on server {1} is already up to date".format(
+                    nic_name, server.hostname))
 
-        # remove all existing NICs if flag set to do so
         if delete_first:
-            for nic_obj in vm_obj.nics.list():
-                logger.info("Removing NIC from server {0}".format(server.hostname))
-                # try to delete NIC for three minutes
-                tries = 10
-                while tries > 0:
-                    try:
-                        nic_obj.delete()
-                        break
-                    except sdk.Error as e:
-                        message = "Waiting to delete NIC from server {0}.  Error: {1}"
-                        logger.info(message.format(server.hostname, e))
-                    tries -= 1
-                    time.sleep(5)
-                else:
-                    message = "Delete NIC failed for server {0}".format(server.hostname)
-                    logger.info(message)
-                    raise CloudBoltException(message)
-
-        # add requested NICs
-        network_counter = 0
-        for network in server_net_list:
-            mac, ip = server.get_mac_ip(network_counter)
+            for nic_name, nic_obj in current_nics.items():
+                changes.append((nic_name, "remove", nic_obj))
+
+        with trace_span("change nics"):
+            macs = self._change_nics(server, vm_id, changes)
+
+        # Record the NICs in CloudBolt, writing only the rows that changed
+        existing = dict((nic.index, nic) for nic in ServerNetworkCard.objects.filter(
+            server=server, index__lt=len(desired)))
+        to_create = []
+        to_save = []
+        for index, nic_name, network, mac, ip in desired:
+            nic = existing.get(index)
+            if nic is None:
+                nic = ServerNetworkCard(index=index, server=server)
+                to_create.append(nic)
+            values = dict(network=network,
+                          mac=macs.get(nic_name, kept_macs.get(nic_name, mac)))
+            if ip:
+                values.update(ip=ip, bootproto="dhcp" if ip == "dhcp" else "static")
+            changed = False
+            for field, value in values.items():
+                if getattr(nic, field) != value:
+                    setattr(nic, field, value)
+                    changed = True
+            if changed and nic.pk:
+                to_save.append(nic)
+
+        with trace_span("save nics"), transaction.atomic():
+            if to_create:
+                ServerNetworkCard.objects.bulk_create(to_create)
+            for nic in to_save:
+                nic.save()
+
+    def get_vnic_profile_ids(self):
+        """
+        Return a dict mapping network uuids to the id of the vNIC profile to
+        attach NICs on that network to, preferring the profile named after
+        the network (which RHEV creates by default).
+        """
+        profile_ids = {}
+        names = {}
+        for network_obj in self.system_service.networks_service().list():
+            names[network_obj.id] = network_obj.name
+        for profile in self.system_service.vnic_profiles_service().list():
+            network_id = profile.network.id
+            if network_id not in profile_ids or profile.name == names.get(network_id):
+                profile_ids[network_id] = profile.id
+        return profile_ids
+
+    def _change_nics(self, server, vm_id, changes):
+        """
+        Apply `changes`, a list of (nic name, action, SDK Nic) tuples where
+        action is 'add', 'update' or 'remove', to the VM, up to
+        `nic_change_concurrency` at a time. Each change is retried while the
+        VM is locked.
 
-            nic_name = "nic{0}".format(network_counter + 1)
-            nic_obj = vm_obj.nics.get(name=nic_name)
-            # try to add NIC for three minutes
+        Returns a dict of the MAC addresses RHEV reports for added and
+        updated NICs, by NIC name.
+        """
+        collectors = current_collectors()
+        parent = current_span()
+
+        def change(nic_name, action, nic_obj):
+            with self.releasing_connections(), sharing_collectors(collectors), \
+                    adopting_span(parent), \
+                    trace_span("{0} {1}".format(action, nic_name)) as span:
+                return self._change_nic(server, vm_id, nic_name, action,
+                                        nic_obj, span)
+
+        if not changes:
+            return {}
+
+        # Each change is made on a worker thread with its own connection, so
+        # give back this thread's connection rather than hold it while the
+        # workers wait for theirs
+        self.release_connection()
+        macs = {}
+        workers = min(len(changes), self.nic_change_concurrency)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = dict((executor.submit(change, *c), c[0]) for c in changes)
+            for future in as_completed(futures):
+                nic_obj = future.result()
+                if nic_obj is not None and nic_obj.mac is not None:
+                    macs[futures[future]] = nic_obj.mac.address
+        return macs
+
+    def _change_nic(self, server, vm_id, nic_name, action, nic_obj, span):
+        """
+        Make one of the changes for _change_nics(), retrying while the VM is
+        locked and counting the retries on `span`
+        """
+        nics_service = self.get_vm_service(vm_id).nics_service()
+        if action == "add":
             logger.info("Adding NIC to server {0}".format(server.hostname))
+            request = lambda: nics_service.add(nic_obj)
             tries = 36
-            while tries > 0:
-                try:
-                    # Check to see if nic already exists, update the network if
-                    # it does, create it if it doesn't
-                    # if not nic_obj:
-                    #     params = types.HostNic(
-                    #         name=nic_name,
-                    #         interface="virtio",
-                    #         network=cluster_obj.networks.get(id=network.uuid),
-                    #         mac=types.MAC(mac) if mac else None,
-                    #     )
-                    #     nic_obj = vm_obj.nics.add(params)
-                    # else:
-                    #     net_obj = cluster_obj.networks.get(id=network.uuid),
-                    #     nic_obj.set_network(net_obj)
-                    # mac = nic_obj.mac.address
-                    break
-                    # TODO: fix this with types.NicConfiguration?
-                except sdk.Error as e:
-                    # This may catch more errors than we want
-                    message = "Waiting to add nic to server {0}"
-                    logger.info(message.format(server.hostname))
-                    logger.debug(e)
-                tries -= 1
-                time.sleep(5)
-            else:
-                message = "Add nic failed for server {}".format(server.hostname)
-                logger.info(message)
-                # TODO: set NIC to actual state in cloudbolt
-                raise CloudBoltException(message)
-
-            nic, created = ServerNetworkCard.objects.get_or_create(
-                index=network_counter,
-                server=server)
-            network_counter += 1
-            if ip:
-                nic.ip = ip
-                nic.bootproto = "dhcp" if ip == "dhcp" else "static"
-            nic.network = network
-            nic.mac = mac
-            nic.save()
+        elif action == "update":
+            logger.info("Moving NIC {0} on server {1} to a new network".format(
+                nic_name, server.hostname))
+            request = lambda: nics_service.nic_service(nic_obj.id).update(nic_obj)
+            tries = 36
+        else:
+            logger.info("Removing NIC from server {0}".format(server.hostname))
+            request = nics_service.nic_service(nic_obj.id).remove
+            tries = 10
 
+        while True:
+            tries -= 1
+            try:
+                return request()
+            except sdk.Error as e:
+                if tries <= 0:
+                    message = "{0} NIC failed for server {1}".format(
+                        action.capitalize(), server.hostname)
+                    logger.info(message)
+                    # TODO: set NIC to actual state in cloudbolt
+                    raise CloudBoltException(message)
+                message = "Waiting to {0} NIC on server {1}.  Error: {2}"
+                logger.info(message.format(action, server.hostname, e))
+                span.add_retry()
+            time.sleep(5)
+
+    @traced("create_resource")
+    @summarize_api_calls("Creating a server")
     def create_resource(self, resource_id, use_template):
         """
         Provisions a new VM using the information provided by the server
@@ -269,16 +787,130 @@ class RhevResourceHandler(ResourceHandler):
         server = Server.objects.get(id=resource_id)
         logger.info("creating new vm {0}".format(server.hostname))
 
-        os_attributes = self.osbuildattribute_set.filter(
-            os_build=server.os_build)
-        template_name = os_attributes[0].cast().template_name
-
-        cluster = self.api.clusters.get(name=self.clusterName)
+        with trace_span("get cluster"):
+            cluster = self.get_cluster()
         if cluster is None:
             message = ("No cluster named {0!r} found when creating server {1}"
-                       .format(self.clusterName, server.hostname))
+                       .format(self.default_cluster_name, server.hostname))
+            logger.info(message)
+            raise CloudBoltException(message)
+
+        with trace_span("get template"):
+            template = self.get_template_for_server(server)
+        return self.create_vm(server, cluster, template)
+
+    def create_resources(self, resource_ids, max_parallel=None):
+        """
+        Provisions new VMs for all the servers specified by resource_ids,
+        creating up to `max_parallel` (default `worker_pool_size`) of them at
+        a time.
+
+        The cluster, and the template for each OS build, are looked up once
+        for the whole batch. Returns a dict mapping each resource_id to a
+        TrueWithMessage on success or a FalseWithMessage saying why that
+        server could not be created.
+        """
+        servers = list(Server.objects.filter(id__in=resource_ids))
+        max_parallel = max_parallel or self.worker_pool_size
+        logger.info("creating {0} new vms, {1} at a time".format(
+            len(servers), max_parallel))
+
+        cluster = self.get_cluster()
+        if cluster is None:
+            message = "No cluster named {0!r} found".format(self.default_cluster_name)
+            logger.info(message)
+            return {server.id: FalseWithMessage(message) for server in servers}
+
+        templates, results = self.get_templates_for_servers(servers)
+        # The workers lease their own connections
+        self.release_connection()
+
+        def create(server):
+            try:
+                with self.releasing_connections():
+                    self.create_vm(server, cluster, templates[server.os_build_id])
+            except Exception as e:
+                # Report any failure against this server alone, so that the
+                # rest of the batch's results are still collected
+                logger.info("Creating server {0} failed: {1!r}".format(
+                    server.hostname, e))
+                return FalseWithMessage(str(e) or e.__class__.__name__)
+            return TrueWithMessage("Created")
+
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            futures = dict(
+                (executor.submit(create, server), server.id)
+                for server in servers if server.id not in results)
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+        return results
+
+    def provision_resources(self, resource_ids, max_parallel=None):
+        """
+        Builds servers end to end: creates their VMs, adds their NICs and
+        powers them on, with each server moving to its next step as soon as
+        RHEV reports the current one done and up to `max_parallel` (default
+        `worker_pool_size`) steps being carried out at a time.
+
+        Returns a dict mapping each resource_id to a TrueWithMessage, or a
+        FalseWithMessage saying which step failed and why.
+        """
+        return ProvisioningPipeline(self, resource_ids, max_parallel).run()
+
+    def get_templates_for_servers(self, servers):
+        """
+        Look up the template for each distinct OS build among `servers`.
+
+        Returns a 2-tuple:
+            templates{}     SDK templates by OS build id
+            failures{}      a FalseWithMessage saying why, by server id, for
+                            each server whose template could not be found
+        """
+        templates = {}
+        template_errors = {}
+        failures = {}
+        for server in servers:
+            build_id = server.os_build_id
+            if build_id not in templates and build_id not in template_errors:
+                try:
+                    templates[build_id] = self.get_template_for_server(server)
+                except CloudBoltException as e:
+                    template_errors[build_id] = str(e)
+            if build_id in template_errors:
+                failures[server.id] = FalseWithMessage(template_errors[build_id])
+        return templates, failures
+
+    def get_cluster(self):
+        """
+        Return the SDK object for the cluster new VMs are created in (the
+        first of cluster_names), or None if RHEV has no cluster by that name.
+        """
+        clusters = self.system_service.clusters_service().list(
+            search='name="{0}"'.format(self.default_cluster_name))
+        return clusters[0] if clusters else None
+
+    def get_clusters(self):
+        """
+        Return the SDK objects for all of this handler's clusters that exist
+        in RHEV.
+        """
+        search = " or ".join('name="{0}"'.format(name) for name in self.cluster_names)
+        return self.system_service.clusters_service().list(search=search)
+
+    def get_template_for_server(self, server):
+        """
+        Return the SDK template to provision `server` from, based on the OS
+        build attribute this RH has for the server's OS build.
+        """
+        os_attribute = self.osbuildattribute_set.filter(
+            os_build=server.os_build).first()
+        if os_attribute is None:
+            message = ("No template is set up on {0} for OS build {1} of "
+                       "server {2}".format(self, server.os_build, server.hostname))
             logger.info(message)
             raise CloudBoltException(message)
+        template_name = os_attribute.cast().template_name
 
         # template = self.api.templates.get(name=template_name)
         # Fix for the ovirt API's bug when dealing with sub-versioned templates
@@ -287,19 +919,32 @@ class RhevResourceHandler(ResourceHandler):
         # be using the template sub-version number - written by Adam Byers @
         # Dell 11/13/15 - ZenDesk ticket #2186
         # https://www.pivotaltracker.com/story/show/118569893
-        template = None
-        currtime = None
-        for tmplt in self.api.templates.list():
-            if tmplt.name == template_name:
-                if not currtime or (tmplt.get_creation_time() > currtime):
-                    currtime = tmplt.get_creation_time()
-                    template = tmplt
+        template = self.get_template_by_name(template_name)
         if template is None:
             message = ("No template named {0!r} found when creating server {1}"
                        .format(template_name, server.hostname))
             logger.info(message)
             raise CloudBoltException(message)
+        return template
 
+    @property
+    def warm_pool(self):
+        return get_warm_pool(self.id)
+
+    def create_vm(self, server, cluster, template):
+        """
+        Create the VM for `server` from `template` in `cluster` and record its
+        uuid on the server
+
+        With `warm_pool_size` set, a powered-off VM already cloned from the
+        template is renamed and resized for the server when one is available,
+        and the pool is refilled in the background.
+
+        Returns a task id for is_task_complete() that tracks the copy of the
+        template's disks to the new VM. It includes the correlation id sent
+        with the request, which identifies the job in the engine's logs.
+        """
+        correlation_id = uuid4().hex
         try:
             cpu_topology = types.CpuTopology(
                 cores=1,
@@ -307,28 +952,43 @@ class RhevResourceHandler(ResourceHandler):
             )
             temp = dict(
                 name=server.get_vm_name(),
-                cpu=types.CPU(topology=cpu_topology),
+                cpu=types.Cpu(topology=cpu_topology),
                 memory=server.mem_size * ONE_GIG,
-                display=types.Display(type_="spice"),
+                display=types.Display(type=types.DisplayType.SPICE),
                 cluster=cluster,
                 template=template,
             )
             logger.info("sending: {0}".format(temp))
-            params = types.VM(**temp)
-            new_vm = self.api.vms.add(vm=params)
-            uuid = new_vm.id
+            params = types.Vm(**temp)
+            uuid = None
+            if self.warm_pool_size:
+                with trace_span("claim warm vm"):
+                    uuid = self.warm_pool.claim(
+                        self, template, cluster,
+                        types.Vm(name=params.name, cpu=params.cpu,
+                                 memory=params.memory),
+                        correlation_id)
+                self.warm_pool.refill(self, template, cluster,
+                                      self.warm_pool_size)
+            if uuid is None:
+                with trace_span("clone template"):
+                    new_vm = self.system_service.vms_service().add(
+                        params, query=dict(correlation_id=correlation_id))
+                uuid = new_vm.id
             logger.info("new vm uuid: {0}".format(uuid))
 
             server.resource_handler_svr_id = uuid
             server.save()
         except sdk.Error as e:
             message = ("Create resource response for server {0}: {1}"
-                       .format(server.hostname, e.detail))
+                       .format(server.hostname, e))
             logger.info(message)
             raise CloudBoltException(message)
 
-        return ""
+        return "{0}:{1}".format(uuid, correlation_id)
 
+    @traced("delete_resource")
+    @summarize_api_calls("Deleting a server")
     def delete_resource(self, resource_id):
         """
         Delete the VM specified by resource_id
@@ -349,18 +1009,42 @@ class RhevResourceHandler(ResourceHandler):
             message = "Unable to power down host."
             return FalseWithMessage(message)
 
+        vm_id = server.resource_handler_svr_id
         try:
-            vm = self.api.vms.get(id=server.resource_handler_svr_id)
-            vm.delete()
+            with trace_span("remove vm"):
+                self.get_vm_service(vm_id).remove()
 
         except sdk.Error as e:
             message = "Delete response for server {0}: {1}".format(
-                server.hostname, e.detail)
+                server.hostname, e)
             logger.info(message)
             return FalseWithMessage(message)
 
+        # Removal continues in the background while the disks are deleted
+        with trace_span("wait for removal"):
+            state = self.wait_for_vm_state(vm_id, [ABSENT], self.power_timeout)
+        if state is None:
+            message = "Server {0} is still being removed after {1} seconds."
+            logger.info(message.format(server.hostname, self.power_timeout))
+
         return TrueWithMessage("Deleted")
 
+    @property
+    def template_index(self):
+        return get_template_index(self.id, self.template_index_ttl)
+
+    def get_template_by_name(self, template_name):
+        """
+        Return the most recently created version of the named template, or
+        None if there is no such template.
+
+        Lookups are served from the handler's template index, so a burst of
+        provisions lists the engine's templates at most once per
+        `template_index_ttl` seconds.
+        """
+        return self.template_index.get_by_name(
+            template_name, self.system_service.templates_service().list)
+
     def get_uuid(self, resource_id):
         """Retrieve the UUID of the given VM"""
         server = Server.objects.get(id=resource_id)
@@ -368,10 +1052,49 @@ class RhevResourceHandler(ResourceHandler):
 
     def is_task_complete(self, resource_id, task_id):
         """
-        TODO: Implement a more sophisticated method for determining task
-        progress
+        Return a (complete, percent done) tuple for a task id returned by
+        create_resource, raising CloudBoltException if the task failed.
+        """
+        if not task_id:
+            # Nothing asynchronous was started
+            return True, 100
+        status = self.get_task_statuses([task_id])[task_id]
+        if isinstance(status, CloudBoltException):
+            raise status
+        return status
+
+    def get_task_statuses(self, task_ids):
+        """
+        Return a dict mapping each of `task_ids` to the (complete, percent
+        done) tuple is_task_complete() would return for it, or to the
+        CloudBoltException it would raise if the task failed, using one
+        query for the VMs of all the tasks.
+
+        A new VM keeps its disks locked while they are copied from the
+        template, so progress is the share of its disks that are unlocked. If
+        the copy fails, the engine removes the VM again.
         """
-        return True, 100
+        tasks = dict((task_id, task_id.split(":", 1)[0]) for task_id in task_ids)
+        api_vms = dict(
+            (vm_obj.id, vm_obj) for vm_obj in self.list_vms_by_id(
+                set(tasks.values()), follow="disk_attachments.disk"))
+
+        statuses = {}
+        for task_id, vm_id in tasks.items():
+            vm_obj = api_vms.get(vm_id)
+            if vm_obj is None:
+                statuses[task_id] = CloudBoltException(
+                    "VM {0} no longer exists in RHEV; creating it failed "
+                    "(task {1})".format(vm_id, task_id))
+                continue
+            if vm_obj.status.value != "image_locked":
+                statuses[task_id] = (True, 100)
+                continue
+            disks = [attachment.disk for attachment in vm_obj.disk_attachments or []]
+            unlocked = len([disk for disk in disks if disk.status.value != "locked"])
+            progress = int(99 * unlocked / len(disks)) if disks else 0
+            statuses[task_id] = (False, progress)
+        return statuses
 
     @staticmethod
     def get_credentials_form():
@@ -397,61 +1120,340 @@ class RhevResourceHandler(ResourceHandler):
         from .forms import RhevQuickSetupSettingsForm
         return RhevQuickSetupSettingsForm
 
-    def get_all_vms(self):
+    @summarize_api_calls("VM sync")
+    def get_all_vms(self, incremental=None):
         """
         Queries RHEV for all its VMs and imports them into CloudBolt
+
+        `incremental`: Only re-read the VMs touched by engine events since the
+        last sync, falling back to a full sync when that is not possible.
+        Defaults to the handler's `incremental_vm_sync` setting.
+
+        A full sync consumes iter_all_vms() cluster by cluster, so only one
+        page of SDK objects is held at a time. The vm_dicts returned are the
+        ones kept in the handler's inventory snapshot for the next
+        incremental sync, rather than copies, so callers must not modify
+        them.
+        """
+        if incremental is None:
+            incremental = self.incremental_vm_sync
+        snapshot = self.inventory_snapshot
+        with snapshot.lock:
+            changed = None
+            if incremental:
+                changed = self._sync_vms_from_events(snapshot)
+            if changed is None:
+                self._sync_all_vms(snapshot)
+                changed = True
+            all_vms = list(snapshot.vms.values())
+        if changed:
+            self.inventory_store.write("vms", all_vms)
+        else:
+            self.inventory_store.touch("vms")
+        return all_vms
+
+    @property
+    def vm_fingerprints(self):
+        return get_vm_fingerprints(self.id)
+
+    def get_vm_changes(self, incremental=None):
+        """
+        Sync the VMs like get_all_vms, but return only what changed since the
+        last call, as a dict of:
+            added[]     vm_dicts for new VMs
+            changed[]   vm_dicts for VMs whose synced fields have changed
+            removed[]   uuids of VMs that are gone
+
+        Each vm_dict's "fingerprint" is compared with the one last returned.
+        On the first call, every VM counts as added. If CloudBolt fails to
+        save the changes, call self.vm_fingerprints.clear() so that the next
+        call returns every VM again.
+        """
+        added, changed, removed = self.vm_fingerprints.diff(
+            self.get_all_vms(incremental))
+        logger.info("{0} VMs added, {1} changed and {2} removed since the "
+                    "last sync.".format(len(added), len(changed), len(removed)))
+        return dict(added=added, changed=changed, removed=removed)
+
+    @property
+    def inventory_store(self):
+        return InventoryStore(os.path.join(
+            self.cert_directory, "inventory", str(self.id)),
+            default=get_inventory_key)
+
+    def get_inventory(self, section, max_age=None):
+        """
+        Return this handler's 'vms', 'networks' or 'templates' from the
+        inventory last saved by any CloudBolt process, if it is no more than
+        `max_age` (default `inventory_max_age`) seconds old. Otherwise fetch
+        it from RHEV, which saves it for the next caller.
+
+        Either way the items have the same types: each VM's os_family is
+        saved by name and looked up again, and each template's mem_size is
+        turned back into a Decimal.
+        """
+        if max_age is None:
+            max_age = self.inventory_max_age
+        items = self.inventory_store.read(section, max_age)
+        if items is not None:
+            return self._restore_inventory(section, items)
+        fetchers = dict(
+            vms=self.get_all_vms,
+            networks=self.get_all_networks,
+            templates=lambda: self.discover_templates()[0],
+        )
+        return fetchers[section]()
+
+    @staticmethod
+    def _restore_inventory(section, items):
+        """
+        Turn the values get_inventory_key() saved in `items` back into what
+        a live fetch returns, looking up all the OS families in one query.
+        """
+        if section == "vms":
+            names = set(vm_dict["os_family"] for vm_dict in items
+                        if vm_dict.get("os_family"))
+            families = dict((family.name, family) for family in
+                            OSFamily.objects.filter(name__in=names)) if names else {}
+            for vm_dict in items:
+                vm_dict["os_family"] = families.get(vm_dict.get("os_family"))
+        elif section == "templates":
+            for template in items:
+                if template.get("mem_size") is not None:
+                    template["mem_size"] = Decimal(template["mem_size"])
+        return items
+
+    def _sync_all_vms(self, snapshot):
+        """
+        List every VM in the handler's clusters, all clusters at once, and
+        replace `snapshot` with the result.
         """
         logger.info("Connecting to RHEV to enumerate its VM list.")
 
-        dictify = lambda t: dict(name=t.name, uuid=t.id, description=t.os.type_)
-
-        all_vms = []
-        api_vms = self.api.vms.list(query=self.cluster_query)
-        from types import NoneType
-        logger.info("Found {} VMs ({}).".format(len(api_vms) if type(api_vms) is NoneType else "no", type(api_vms)))
-        for vm_obj in api_vms:
-            logger.info("+Inspecting VM {} ({}).".format(vm_obj, type(vm_obj)))
-            translate_power = dict(up="POWERON", down="POWEROFF")
-            power = translate_power.get(vm_obj.status.state, "UNKNOWN")
-            logger.info("  Power: {} --> {}".format(vm_obj.status.state, power))
-
-            cpus = vm_obj.cpu.topology.sockets * vm_obj.cpu.topology.cores
-
-            total_disk = sum(disk_obj.size for disk_obj in vm_obj.disks.list())
-
-            all_nics = vm_obj.nics.list()
-            primary_mac = all_nics[0].mac.address if all_nics else "NONE"
-            # nics = [dict(mac=nic.mac.address, network=nic.network.id)
-            #        for nic in all_nics]
-
-            # import here to prevent circular import problem
-            from c2_wrapper import guess_os_family
-            guess = guess_os_family(dictify(
-                self.api.templates.get(id=vm_obj.template.id)))
-
-            vm_dict = dict(hostname=vm_obj.name,
-                           mac=primary_mac,
-                           uuid=vm_obj.id,
-                           os_family=guess,
-                           status="ACTIVE",
-                           power_status=power,
-                           cpu_cnt=int(cpus),
-                           disk_size=int(total_disk / ONE_GIG),
-                           mem_size=vm_obj.memory / ONE_GIG,
-                           # nics=nics,
-                           )
-            logger.info("  Dict: {}".format(vm_dict))
-            all_vms.append(vm_dict)
+        # Take the event cursor first, so that changes made while the VMs are
+        # being listed are picked up by the next incremental sync
+        last_event_id = self.get_last_event_id()
 
-        return all_vms
+        all_vms = {}
+        # Per-VM details are only worth logging at info level if there will
+        # not be a summary of the sync instead
+        log_vm = logger.debug if self.log_api_call_summaries else logger.info
+
+        def sync_cluster(name):
+            # Setting dict items is atomic, so the clusters' workers can all
+            # add to all_vms as their pages come in
+            for vm_dict in self.iter_all_vms(cluster_name=name):
+                log_vm("  Dict: {0}".format(vm_dict))
+                all_vms[vm_dict["uuid"]] = vm_dict
+
+        self.map_clusters(sync_cluster)
+        logger.info("Found {0} VMs.".format(len(all_vms)))
+
+        snapshot.replace(all_vms, last_event_id)
+
+    def iter_all_vms(self, page_size=None, cluster_name=None):
+        """
+        Generate the vm_dict for every VM in `cluster_name` (by default, in
+        each of the handler's clusters in turn), reading the VMs a page of
+        `page_size` (default `vm_page_size`) at a time so that only one page
+        of SDK objects is held in memory.
+
+        VMs are listed together with their disk attachments and NICs by
+        following those links in the same request, and OS families are
+        cached per template, so the number of API calls grows with the number
+        of pages and distinct templates rather than the number of VMs.
+        """
+        if cluster_name is None:
+            for name in self.cluster_names:
+                for vm_dict in self.iter_all_vms(page_size, name):
+                    yield vm_dict
+            return
+
+        page_size = page_size or self.vm_page_size
+        system = self.system_service
+        cluster_query = self.get_cluster_query(cluster_name)
+
+        page = 1
+        while True:
+            # Sort so that pages do not overlap or skip VMs
+            search = "{0} sortby name asc page {1}".format(cluster_query, page)
+            api_vms = system.vms_service().list(
+                search=search, max=page_size, follow=VM_INVENTORY_LINKS)
+            for vm_obj in api_vms:
+                if not is_warm_vm(vm_obj):
+                    yield self.vm_to_dict(vm_obj, cluster_name)
+            if len(api_vms) < page_size:
+                return
+            page += 1
+
+    def _sync_vms_from_events(self, snapshot):
+        """
+        Bring `snapshot` up to date by re-reading only the VMs referenced by
+        engine events newer than its cursor, and return whether any of its
+        VMs changed.
+
+        Return None without changing anything when a full sync is needed
+        instead: there is no previous sync, it is older than
+        `incremental_sync_max_age`, or more than
+        `incremental_sync_max_events` events have happened since.
+        """
+        if not snapshot.is_fresh(self.incremental_sync_max_age):
+            return None
+
+        events = self.system_service.events_service().list(
+            from_=snapshot.last_event_id,
+            max=self.incremental_sync_max_events)
+        if len(events) >= self.incremental_sync_max_events:
+            logger.info("Too many RHEV events since the last sync, doing a "
+                        "full sync instead.")
+            return None
+
+        event_ids = [int(event.id) for event in events]
+        touched = set(event.vm.id for event in events if event.vm is not None)
+        logger.info("Syncing {0} VMs touched by {1} RHEV events.".format(
+            len(touched), len(events)))
+
+        if touched:
+            cluster_names = dict((cluster.id, cluster.name)
+                                 for cluster in self.get_clusters())
+            api_vms = [vm_obj for vm_obj in self.list_vms_by_id(
+                           touched, follow=VM_INVENTORY_LINKS)
+                       if vm_obj.cluster.id in cluster_names
+                       and not is_warm_vm(vm_obj)]
+            changed = dict(
+                (vm_obj.id, self.vm_to_dict(vm_obj, cluster_names[vm_obj.cluster.id]))
+                for vm_obj in api_vms)
+            # Anything touched that is no longer in our clusters was removed
+            # or moved elsewhere
+            removed = touched - set(changed)
+        else:
+            changed, removed = {}, set()
+
+        return snapshot.update(
+            changed, removed, max(event_ids) if event_ids else snapshot.last_event_id)
+
+    def get_last_event_id(self):
+        """
+        Return the id of the newest event on the engine, or None if it has
+        none. The engine lists events newest first.
+        """
+        events = self.system_service.events_service().list(max=1)
+        return int(events[0].id) if events else None
+
+    def list_vms_by_id(self, vm_ids, follow=None, batch_size=100):
+        """
+        Return the SDK VM objects for those of `vm_ids` that exist, using one
+        search per `batch_size` ids.
+        """
+        vm_ids = list(vm_ids)
+        vms_service = self.system_service.vms_service()
+        api_vms = []
+        for start in range(0, len(vm_ids), batch_size):
+            batch = vm_ids[start:start + batch_size]
+            search = " or ".join("id={0}".format(vm_id) for vm_id in batch)
+            api_vms.extend(vms_service.list(search=search, max=len(batch),
+                                            follow=follow))
+        return api_vms
+
+    @property
+    def inventory_snapshot(self):
+        return get_inventory_snapshot(self.id)
+
+    def vm_to_dict(self, vm_obj, cluster_name):
+        """
+        Build the dictionary CloudBolt syncs from an SDK VM object in the
+        cluster called `cluster_name`.
+
+        `vm_obj` must have been fetched with VM_INVENTORY_LINKS followed. The
+        only API call made here is fetching the VM's template, the first time
+        that template is seen.
+        """
+        translate_power = dict(up="POWERON", down="POWEROFF")
+        power = translate_power.get(vm_obj.status.value, "UNKNOWN")
+
+        cpus = vm_obj.cpu.topology.sockets * vm_obj.cpu.topology.cores
+
+        total_disk = sum(attachment.disk.provisioned_size or 0
+                         for attachment in vm_obj.disk_attachments or [])
+
+        all_nics = vm_obj.nics or []
+        primary_mac = all_nics[0].mac.address if all_nics else "NONE"
+        # nics = [dict(mac=nic.mac.address, network=nic.network.id)
+        #        for nic in all_nics]
+
+        vm_dict = dict(hostname=vm_obj.name,
+                       mac=primary_mac,
+                       uuid=vm_obj.id,
+                       os_family=self.guess_vm_os_family(vm_obj),
+                       status="ACTIVE",
+                       power_status=power,
+                       cpu_cnt=int(cpus),
+                       disk_size=int(total_disk / ONE_GIG),
+                       mem_size=vm_obj.memory / ONE_GIG,
+                       # nics=nics,
+                       cluster=cluster_name,
+                       )
+        vm_dict["fingerprint"] = get_vm_fingerprint(vm_dict)
+        return vm_dict
+
+    @property
+    def os_family_cache(self):
+        return get_os_family_cache(self.id, self.os_family_cache_size)
+
+    def guess_vm_os_family(self, vm_obj):
+        """
+        Guess the OS family of a VM from the template it was built from, or
+        from the VM's own OS type if that template no longer exists.
+
+        Guesses are cached per template id until discover_templates runs, so
+        each distinct template is fetched once rather than once per VM.
+        """
+        # import here to prevent circular import problem
+        from c2_wrapper import guess_os_family
+
+        if vm_obj.template is None:
+            return guess_os_family(dictify_template(vm_obj))
+
+        template_id = vm_obj.template.id
+        cache = self.os_family_cache
+        guess = cache.get(template_id, NOT_CACHED)
+        if guess is not NOT_CACHED:
+            return guess
+
+        templates_service = self.system_service.templates_service()
+        try:
+            template = templates_service.template_service(template_id).get()
+        except sdk.NotFoundError:
+            return guess_os_family(dictify_template(vm_obj))
+
+        guess = guess_os_family(dictify_template(template))
+        cache[template_id] = guess
+        return guess
 
     def get_all_networks(self):
         """
         Queries RHEV for all its networks so they can be imported into CloudBolt
+
+        The networks of all the handler's clusters are listed concurrently;
+        a network shared by several clusters is only returned once.
         """
+        cluster_ids = dict((cluster.name, cluster.id)
+                           for cluster in self.get_clusters())
+
+        def list_networks(name):
+            if name not in cluster_ids:
+                logger.info("No cluster named {0!r} found".format(name))
+                return []
+            clusters_service = self.system_service.clusters_service()
+            cluster_service = clusters_service.cluster_service(cluster_ids[name])
+            return cluster_service.networks_service().list()
+
         all_nets = []
-        net_objs = self.api.clusters.get(name=self.clusterName).networks.list()
-        for net_obj in net_objs:
+        seen = set()
+        for net_obj in itertools.chain(*self.map_clusters(list_networks)):
+            if net_obj.id in seen:
+                continue
+            seen.add(net_obj.id)
             # We return the "network" value set to the UUID because CB treats
             # the "network" attribute as the unique identifier for the network
             net_dict = dict(name=net_obj.name,
@@ -459,6 +1461,7 @@ class RhevResourceHandler(ResourceHandler):
                             uuid=net_obj.id,
                             )
             all_nets.append(net_dict)
+        self.inventory_store.write("networks", all_nets)
         return all_nets
 
     def add_network(self, **kwargs):
@@ -469,6 +1472,30 @@ class RhevResourceHandler(ResourceHandler):
         self.networks.add(network)
         return network, created
 
+    def add_networks(self, networks):
+        """
+        Adds RhevNetworks to this RH for every dict in `networks`, as returned
+        by get_all_networks(), creating those not already in CloudBolt.
+
+        Existing networks are found with one query on their uuids and all of
+        the networks are linked to this RH with one M2M add, in a single
+        transaction. Returns the list of RhevNetworks that were created.
+        """
+        with transaction.atomic():
+            by_uuid = dict((network.uuid, network) for network in
+                           RhevNetwork.objects.filter(
+                               uuid__in=[n["uuid"] for n in networks]))
+            created = []
+            for kwargs in networks:
+                if kwargs["uuid"] not in by_uuid:
+                    # bulk_create can't insert into multi-table inherited
+                    # models, so new networks are still created one by one
+                    network = RhevNetwork.objects.create(**kwargs)
+                    by_uuid[network.uuid] = network
+                    created.append(network)
+            self.networks.add(*by_uuid.values())
+        return created
+
     def discover_templates(self):
         """
         Finds the set of templates for the resource handler, for use in places
@@ -481,16 +1508,46 @@ class RhevResourceHandler(ResourceHandler):
             only_in_cb[osba]    a list of OSBuildAttributes that exist in CB but
             no longer have equivalent templates on RHEV
         """
-        all_templates = self.api.templates.list(query=self.cluster_query)
-        dictify = lambda t: dict(name=t.name, uuid=t.id, description=t.os.type_)
-        rhevm_templates = [dictify(t) for t in all_templates]
-        rhevm_uuids = set(t.id for t in all_templates)
-
-        all_osba = self.osbuildattribute_set.all()
-        cb_uuids = set(osba.uuid for osba in all_osba)
+        self.template_index.invalidate()
+        self.os_family_cache.clear()
+
+        # List each cluster's templates concurrently, with their disks, and
+        # tag each template with the first cluster it was found in
+        def list_templates(name):
+            return self.system_service.templates_service().list(
+                search=self.get_cluster_query(name),
+                follow="disk_attachments.disk")
+
+        rhevm_templates = []
+        rhevm_uuids = set()
+        for name, cluster_templates in zip(self.cluster_names,
+                                           self.map_clusters(list_templates)):
+            for template in cluster_templates:
+                if template.id not in rhevm_uuids:
+                    rhevm_uuids.add(template.id)
+                    rhevm_templates.append(dict(
+                        dictify_template(template), cluster=name,
+                        **get_template_sizing(template)))
+
+        cb_attrs = RhevOSBuildAttribute.objects.filter(
+            resourcehandler=self).values_list("uuid", "id", "template_version")
+        cb_uuids = dict((uuid, osba_id) for uuid, osba_id, _ in cb_attrs)
+        cb_versions = dict((uuid, version) for uuid, _, version in cb_attrs)
+
+        # Refresh the saved sizing of templates whose version has changed
+        with transaction.atomic():
+            for template in rhevm_templates:
+                uuid = template["uuid"]
+                if uuid in cb_uuids and cb_versions[uuid] != template["template_version"]:
+                    RhevOSBuildAttribute.objects.filter(id=cb_uuids[uuid]).update(
+                        **dict((f, template[f]) for f in TEMPLATE_SIZING_FIELDS))
+
+        self.inventory_store.write("templates", rhevm_templates)
 
         not_in_cb = [t for t in rhevm_templates if t["uuid"] not in cb_uuids]
-        only_in_cb = [osba for osba in all_osba if osba.uuid not in rhevm_uuids]
+        only_in_cb = list(self.osbuildattribute_set.filter(id__in=[
+            osba_id for uuid, osba_id in cb_uuids.items()
+            if uuid not in rhevm_uuids]))
 
         return rhevm_templates, not_in_cb, only_in_cb
 
@@ -507,14 +1564,55 @@ class RhevResourceHandler(ResourceHandler):
             os_build=os_build, template_name=template_name,
             uuid=kwargs.get("uuid", ""),
             resourcehandler=self,
+            defaults=dict((f, kwargs[f]) for f in TEMPLATE_SIZING_FIELDS
+                          if f in kwargs),
         )
         self.osbuildattribute_set.add(osbuild_attribute)
+        self.template_index.invalidate()
+        return created
+
+    def add_template_attrs_bulk(self, templates):
+        """
+        Add RHEV OS build attrs for many templates at once, creating those
+        this RH does not have yet.
+
+        `templates` is a list of (os_build, template) pairs, where template is
+        a dict as returned by discover_templates(). Existing attrs are found
+        with one query on their uuids, in a single transaction. Returns the
+        number of attrs created.
+        """
+        with transaction.atomic():
+            cb_uuids = set(RhevOSBuildAttribute.objects.filter(
+                resourcehandler=self,
+                uuid__in=[t["uuid"] for _, t in templates],
+            ).values_list("uuid", flat=True))
+
+            created = 0
+            for os_build, template in templates:
+                if template["uuid"] in cb_uuids:
+                    continue
+                # bulk_create can't insert into multi-table inherited models,
+                # so new attrs are still created one by one
+                RhevOSBuildAttribute.objects.create(
+                    os_build=os_build, template_name=template["name"],
+                    uuid=template["uuid"], resourcehandler=self,
+                    **dict((f, template[f]) for f in TEMPLATE_SIZING_FIELDS
+                           if f in template))
+                cb_uuids.add(template["uuid"])
+                created += 1
+
+        self.template_index.invalidate()
         return created
 
     def get_extra_details_tech(self):
         """Return tech-specific details to be shown in RH list view.
         """
-        return dict(Cluster=self.clusterName)
+        details = dict(Cluster=", ".join(self.cluster_names))
+        calls, errors, seconds = self.call_stats.totals()
+        if calls:
+            details["API calls"] = "{0} ({1} errors, {2:.0f} ms average)".format(
+                calls, errors, 1000 * seconds / calls)
+        return details
 
 
 RH_CLASS = RhevResourceHandler
@@ -0,0 +1,191 @@
+"""
+Pipelined provisioning of many servers on one RHEV handler.
+
+Each server moves through the stages in ProvisioningPipeline.stages: create
+the VM, wait for its disks to finish copying, add its NICs, start it and wait
+for it to come up. Stages that do work run on a bounded thread pool; stages
+that wait register with the handler's status watcher and hold no thread.
+Every server advances as soon as the engine reports its current stage done,
+so different servers are in different stages at the same time and nothing
+waits on a fixed sleep.
+"""
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+
+from common.classes import TrueWithMessage, FalseWithMessage
+from infrastructure.models import Server
+from utilities.logger import ThreadLogger
+
+from .instrumentation import current_collectors, sharing_collectors
+from .watchers import ABSENT, VM_UNLOCKED_STATES
+
+logger = ThreadLogger(__name__)
+
+# A stage either runs `action(provision)` on a worker thread, or waits up to
+# `timeout(handler)` seconds for the VM to reach one of `states`
+Stage = namedtuple("Stage", "name action states timeout")
+
+
+class _Provision(object):
+    """
+    The progress of one server through the pipeline.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.stage = -1
+        self.stage_started = None
+        self.timings = []
+        # (watcher handle, deadline) while in a waiting stage
+        self.wait = None
+
+
+class ProvisioningPipeline(object):
+
+    def __init__(self, handler, resource_ids, max_parallel=None):
+        self.handler = handler
+        self.resource_ids = resource_ids
+        self.max_parallel = max_parallel or handler.worker_pool_size
+        self.stages = [
+            Stage("creating", self._create, None, None),
+            Stage("waiting for disks", None, VM_UNLOCKED_STATES + (ABSENT,),
+                  lambda h: h.image_lock_timeout),
+            Stage("adding NICs", self._add_nics, None, None),
+            Stage("powering on", self._power_on, None, None),
+            Stage("booting", None, ("up", ABSENT), lambda h: h.power_timeout),
+        ]
+
+        # Looked up once per run
+        self.cluster = None
+        self.templates = {}
+
+        # Completion events, as (resource_id, stage index, error message or
+        # None), posted by workers and the status watcher
+        self._events = Queue()
+        self._active = {}
+        self._results = {}
+
+    def run(self):
+        """
+        Provision every server and return a dict mapping each resource_id to
+        a TrueWithMessage, or a FalseWithMessage naming the stage it failed
+        in and why.
+        """
+        servers = list(Server.objects.filter(id__in=self.resource_ids))
+        logger.info("Provisioning {0} servers, {1} at a time".format(
+            len(servers), self.max_parallel))
+
+        self.cluster = self.handler.get_cluster()
+        if self.cluster is None:
+            message = "No cluster named {0!r} found".format(
+                self.handler.default_cluster_name)
+            logger.info(message)
+            return dict((server.id, FalseWithMessage(message)) for server in servers)
+
+        self.templates, self._results = self.handler.get_templates_for_servers(servers)
+        self._collectors = current_collectors()
+        # Only the workers talk to RHEV-M from here on, each on its own
+        # connection
+        self.handler.release_connection()
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            self._executor = executor
+            for server in servers:
+                if server.id not in self._results:
+                    provision = self._active[server.id] = _Provision(server)
+                    self._advance(provision)
+
+            while self._active:
+                # Check deadlines on every pass, since a busy batch may never
+                # go a second without an event
+                self._expire_waits()
+                if not self._active:
+                    break
+                try:
+                    resource_id, stage, error = self._events.get(timeout=1)
+                except Empty:
+                    continue
+                provision = self._active.get(resource_id)
+                if provision is None or provision.stage != stage:
+                    # A late event for a stage that already timed out
+                    continue
+                if error:
+                    self._fail(provision, error)
+                else:
+                    self._advance(provision)
+
+        return self._results
+
+    def _advance(self, provision):
+        """
+        Move `provision` on to its next stage, or finish it after the last.
+        """
+        now = time.time()
+        if provision.stage >= 0:
+            provision.timings.append(
+                (self.stages[provision.stage].name, now - provision.stage_started))
+        provision.stage += 1
+        provision.stage_started = now
+        provision.wait = None
+
+        if provision.stage == len(self.stages):
+            server = provision.server
+            del self._active[server.id]
+            logger.info("Provisioned {0}: {1}".format(server.hostname, ", ".join(
+                "{0} {1:.0f}s".format(name, seconds)
+                for name, seconds in provision.timings)))
+            self._results[server.id] = TrueWithMessage("Provisioned")
+            return
+
+        stage = self.stages[provision.stage]
+        if stage.action is not None:
+            self._executor.submit(self._run_action, stage.action, provision,
+                                  provision.stage)
+        else:
+            # Waiting stages also end if the VM disappears, as it does when
+            # the engine fails to copy its disks, so fail those at once
+            resource_id, index = provision.server.id, provision.stage
+            handle = self.handler.status_watcher.watch(
+                provision.server.resource_handler_svr_id, stage.states,
+                lambda state: self._events.put((
+                    resource_id, index,
+                    "VM was removed" if state == ABSENT else None)))
+            provision.wait = (handle, now + stage.timeout(self.handler))
+
+    def _run_action(self, action, provision, index):
+        error = None
+        try:
+            with self.handler.releasing_connections(), \
+                    sharing_collectors(self._collectors):
+                action(provision)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        self._events.put((provision.server.id, index, error))
+
+    def _expire_waits(self):
+        now = time.time()
+        for provision in list(self._active.values()):
+            if provision.wait and now > provision.wait[1]:
+                self.handler.status_watcher.unwatch(provision.wait[0])
+                self._fail(provision, "timed out")
+
+    def _fail(self, provision, error):
+        server = provision.server
+        del self._active[server.id]
+        message = "Provisioning {0} failed while {1}: {2}".format(
+            server.hostname, self.stages[provision.stage].name, error)
+        logger.info(message)
+        self._results[server.id] = FalseWithMessage(message)
+
+    def _create(self, provision):
+        server = provision.server
+        self.handler.create_vm(server, self.cluster, self.templates[server.os_build_id])
+
+    def _add_nics(self, provision):
+        self.handler.add_nics_to_server(provision.server.id)
+
+    def _power_on(self, provision):
+        vm_id = provision.server.resource_handler_svr_id
+        self.handler.get_vm_service(vm_id).start()
@@ -0,0 +1,587 @@
+"""
+Stand-ins for the parts of Django and CloudBolt that the rhev app imports, so
+that the app can be loaded and driven outside a CloudBolt install.
+
+Models keep their instances in memory, and querysets support the lookups the
+app uses (exact, __in and __lt). load_app() installs the stand-ins and
+imports the app as resourcehandlers.rhev, as CloudBolt does.
+"""
+import atexit
+import contextlib
+import datetime
+import importlib.util
+import itertools
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import types
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_NAME = "resourcehandlers.rhev"
+
+_lock = threading.RLock()
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class ObjectDoesNotExist(Exception):
+    pass
+
+
+# Models
+
+class Field(object):
+
+    def __init__(self, *args, **kwargs):
+        self.default = kwargs.get("default")
+        self.unique = kwargs.get("unique", False)
+        self.auto_now_add = kwargs.get("auto_now_add", False)
+
+    def get_default(self):
+        if self.auto_now_add:
+            return datetime.datetime.utcnow()
+        return self.default() if callable(self.default) else self.default
+
+
+class ManyToManyField(Field):
+    pass
+
+
+def _matches(obj, lookups):
+    for key, expected in lookups.items():
+        name, _, op = key.partition("__")
+        value = getattr(obj, name, None)
+        if op == "in":
+            if value not in list(expected):
+                return False
+        elif op == "lt":
+            if value is None or not value < expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+class QuerySet(object):
+
+    def __init__(self, model, items=None):
+        self.model = model
+        self._items = items
+
+    def _all(self):
+        if self._items is not None:
+            return list(self._items)
+        with _lock:
+            return [o for o in self.model._instances if isinstance(o, self.model)]
+
+    def all(self):
+        return QuerySet(self.model, self._all())
+
+    def filter(self, **lookups):
+        return QuerySet(self.model, [o for o in self._all() if _matches(o, lookups)])
+
+    def exclude(self, **lookups):
+        return QuerySet(self.model, [o for o in self._all()
+                                     if not _matches(o, lookups)])
+
+    def order_by(self, *fields):
+        items = self._all()
+        for field in reversed(fields):
+            items.sort(key=lambda o: getattr(o, field.lstrip("-")),
+                       reverse=field.startswith("-"))
+        return QuerySet(self.model, items)
+
+    def select_related(self, *args):
+        return self
+
+    prefetch_related = select_related
+
+    def first(self):
+        items = self._all()
+        return items[0] if items else None
+
+    def get(self, **lookups):
+        items = self.filter(**lookups)._all()
+        if len(items) != 1:
+            raise ObjectDoesNotExist("{0} matching {1}: {2}".format(
+                self.model.__name__, lookups, len(items)))
+        return items[0]
+
+    def count(self):
+        return len(self._all())
+
+    def exists(self):
+        return bool(self._all())
+
+    def values_list(self, *fields, **kwargs):
+        if kwargs.get("flat"):
+            return [getattr(o, fields[0]) for o in self._all()]
+        return [tuple(getattr(o, f) for f in fields) for o in self._all()]
+
+    def values(self, *fields):
+        return [dict((f, getattr(o, f)) for f in fields) for o in self._all()]
+
+    def update(self, **values):
+        items = self._all()
+        for o in items:
+            for name, value in values.items():
+                setattr(o, name, value)
+        return len(items)
+
+    def delete(self):
+        for o in self._all():
+            o.delete()
+
+    def create(self, **kwargs):
+        obj = self.model(**kwargs)
+        obj.save()
+        return obj
+
+    def get_or_create(self, defaults=None, **lookups):
+        with _lock:
+            existing = self.filter(**lookups).first()
+            if existing is not None:
+                return existing, False
+            values = dict(lookups)
+            values.update(defaults or {})
+            return self.create(**values), True
+
+    def bulk_create(self, objs):
+        for obj in objs:
+            obj.save()
+        return objs
+
+    def __iter__(self):
+        return iter(self._all())
+
+    def __len__(self):
+        return len(self._all())
+
+    def __getitem__(self, index):
+        return self._all()[index]
+
+
+class Manager(object):
+
+    def __init__(self, model):
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(QuerySet(self.model), name)
+
+
+class ModelBase(type):
+    """
+    Collects each model's fields, and gives every model hierarchy one shared
+    list of instances, so that querying a base model finds its subclasses'
+    instances too (as multi-table inheritance does).
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        fields = {}
+        for base in bases:
+            fields.update(getattr(base, "_fields", {}))
+        for key, value in list(attrs.items()):
+            if isinstance(value, Field):
+                fields[key] = attrs.pop(key)
+        cls = super(ModelBase, mcs).__new__(mcs, name, bases, attrs)
+        cls._fields = fields
+        base_model = globals().get("Model")
+        if base_model is None or base_model in bases:
+            cls._instances = []
+            cls._ids = itertools.count(1)
+        cls.objects = Manager(cls)
+        cls.DoesNotExist = ObjectDoesNotExist
+        return cls
+
+
+class Model(ModelBase("ModelBase", (object,), {})):
+
+    def __init__(self, **kwargs):
+        self.id = kwargs.pop("id", None)
+        for name, field in self._fields.items():
+            if isinstance(field, ManyToManyField):
+                setattr(self, name, RelatedSet())
+            else:
+                setattr(self, name, field.get_default())
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    @property
+    def pk(self):
+        return self.id
+
+    def save(self, *args, **kwargs):
+        with _lock:
+            if self.id is not None and any(o is self for o in self._instances):
+                return
+            for name, field in self._fields.items():
+                if field.unique and any(
+                        isinstance(o, type(self)) and
+                        getattr(o, name) == getattr(self, name)
+                        for o in self._instances):
+                    raise IntegrityError("Duplicate {0}.{1}".format(
+                        type(self).__name__, name))
+            if self.id is None:
+                self.id = next(self._ids)
+            self._instances.append(self)
+
+    def delete(self):
+        with _lock:
+            self._instances[:] = [o for o in self._instances if o is not self]
+
+    def cast(self):
+        return self
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return (isinstance(other, Model) and self.id is not None and
+                self._instances is other._instances and self.id == other.id)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return id(self)
+
+    def __str__(self):
+        return getattr(self, "name", None) or "{0} {1}".format(
+            type(self).__name__, self.id)
+
+
+class RelatedSet(QuerySet):
+    """
+    The objects on one side of a many-to-many relation
+    """
+
+    def __init__(self):
+        super(RelatedSet, self).__init__(Model, [])
+
+    def add(self, *objs):
+        for obj in objs:
+            if not any(o is obj for o in self._items):
+                self._items.append(obj)
+
+
+class ReverseRelatedSet(QuerySet):
+    """
+    The instances of `model` whose `field` points at `instance`
+    """
+
+    def __init__(self, model, field, instance):
+        super(ReverseRelatedSet, self).__init__(model)
+        self._field = field
+        self._instance = instance
+
+    def _all(self):
+        return [o for o in super(ReverseRelatedSet, self)._all()
+                if getattr(o, self._field) == self._instance]
+
+    def add(self, *objs):
+        for obj in objs:
+            setattr(obj, self._field, self._instance)
+            obj.save()
+
+
+class Prefetch(object):
+
+    def __init__(self, lookup, queryset=None, to_attr=None):
+        self.lookup, self.queryset, self.to_attr = lookup, queryset, to_attr
+
+
+# CloudBolt
+
+class TrueWithMessage(object):
+
+    def __init__(self, message=""):
+        self.message = message
+
+    def __bool__(self):
+        return True
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return "TrueWithMessage({0!r})".format(self.message)
+
+
+class FalseWithMessage(TrueWithMessage):
+
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return "FalseWithMessage({0!r})".format(self.message)
+
+
+class CloudBoltException(Exception):
+    pass
+
+
+class OSFamily(Model):
+    name = Field()
+
+
+class OSBuild(Model):
+    name = Field()
+
+
+class OSBuildAttribute(Model):
+    os_build = Field()
+    template_name = Field()
+    resourcehandler = Field()
+
+    class Meta(object):
+        pass
+
+
+class Environment(Model):
+    name = Field()
+
+
+class ResourceNetwork(Model):
+    name = Field()
+    network = Field()
+
+
+class ResourceHandler(Model):
+    name = Field(default="")
+    ip = Field()
+    port = Field(default=443)
+    protocol = Field(default="https")
+    serviceaccount = Field(default="admin@internal")
+    servicepasswd = Field(default="secret")
+
+    @property
+    def osbuildattribute_set(self):
+        return ReverseRelatedSet(OSBuildAttribute, "resourcehandler", self)
+
+    @property
+    def environment_set(self):
+        return QuerySet(Environment, [])
+
+    def get_ssl_verification(self):
+        return True
+
+
+class Server(Model):
+    hostname = Field()
+    cpu_cnt = Field(default=1)
+    mem_size = Field(default=1)
+    os_build = Field()
+    resource_handler_svr_id = Field(default="")
+
+    def __init__(self, **kwargs):
+        self.networks = kwargs.pop("networks", [])
+        super(Server, self).__init__(**kwargs)
+
+    @property
+    def os_build_id(self):
+        return self.os_build.id if self.os_build else None
+
+    def get_vm_name(self):
+        return self.hostname
+
+    def get_network_list(self):
+        return list(self.networks)
+
+    def get_mac_ip(self, index):
+        return None, None
+
+
+class ServerNetworkCard(Model):
+    index = Field()
+    server = Field()
+    network = Field()
+    mac = Field()
+    ip = Field()
+    bootproto = Field()
+
+
+def guess_os_family(template_dict):
+    name = "Windows" if "windows" in (template_dict.get("description") or "").lower() else "Linux"
+    family, _ = OSFamily.objects.get_or_create(name=name)
+    return family
+
+
+# Module layout
+
+class _FormField(object):
+
+    def __init__(self, *args, **kwargs):
+        self.kwargs = kwargs
+        self.initial = None
+
+
+class ValidationError(Exception):
+    pass
+
+
+class _Form(object):
+
+    class Meta(object):
+        fields = ()
+
+
+class _Connection(object):
+
+    def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def _atomic(*args, **kwargs):
+    with _lock:
+        yield
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    # Every stand-in can have submodules
+    module.__path__ = []
+    sys.modules[name] = module
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def install(vardir=None):
+    """
+    Register the stand-in modules, unless they already are. Returns the
+    directory used as CloudBolt's VARDIR: `vardir`, or else a temporary
+    directory removed when the process exits.
+    """
+    if "utilities.logger" in sys.modules:
+        return sys.modules["settings"].VARDIR
+    if vardir is None:
+        vardir = tempfile.mkdtemp(prefix="rhev-tests-")
+        atexit.register(shutil.rmtree, vardir, True)
+
+    _module("django")
+    _module("django.db", connection=_Connection(), IntegrityError=IntegrityError)
+    _module("django.db.models", Model=Model, Field=Field,
+            CharField=Field, IntegerField=Field, DecimalField=Field,
+            DateTimeField=Field, ManyToManyField=ManyToManyField,
+            Prefetch=Prefetch)
+    _module("django.db.transaction", atomic=_atomic)
+    _module("django.utils")
+    _module("django.utils.encoding", python_2_unicode_compatible=lambda cls: cls)
+    _module("django.utils.timezone", now=datetime.datetime.utcnow)
+    _module("django.forms", CharField=_FormField, ChoiceField=_FormField,
+            ModelMultipleChoiceField=_FormField, ValidationError=ValidationError)
+    _module("django.contrib")
+    _module("django.contrib.admin", site=types.SimpleNamespace(
+        register=lambda *args, **kwargs: None))
+
+    _module("common")
+    _module("common.classes", TrueWithMessage=TrueWithMessage,
+            FalseWithMessage=FalseWithMessage)
+    _module("utilities")
+    _module("utilities.exceptions", CloudBoltException=CloudBoltException)
+    _module("utilities.logger", ThreadLogger=logging.getLogger)
+    _module("settings", VARDIR=vardir)
+    _module("c2_wrapper", guess_os_family=guess_os_family)
+    _module("externalcontent")
+    _module("externalcontent.models", OSFamily=OSFamily, OSBuild=OSBuild,
+            OSBuildAttribute=OSBuildAttribute)
+    _module("infrastructure")
+    _module("infrastructure.models", Server=Server,
+            ServerNetworkCard=ServerNetworkCard, Environment=Environment)
+    _module("resourcehandlers")
+    _module("resourcehandlers.models", ResourceHandler=ResourceHandler,
+            ResourceNetwork=ResourceNetwork)
+    _module("resourcehandlers.forms",
+            BaseResourceHandlerCredentialsForm=type(
+                "BaseResourceHandlerCredentialsForm", (_Form,), {
+                    "Meta": type("Meta", (object,), {"fields": (
+                        "ip", "port", "serviceaccount", "servicepasswd")})}),
+            BaseResourceHandlerSettingsForm=type(
+                "BaseResourceHandlerSettingsForm", (_Form,), {
+                    "Meta": type("Meta", (object,), {"fields": ("name",)})}))
+    _module("resourcehandlers.views", NETWORK_TABLE_VALUES=("name", "network"),
+            get_detail_tabs=lambda handler, profile: [])
+    _module("resourcehandlers.admin", ResourceHandlerAdmin=object)
+    try:
+        import requests  # noqa: F401
+    except ImportError:
+        _module("requests")
+    return vardir
+
+
+def load_app(vardir=None):
+    """
+    Install the stand-ins and import the rhev app package, returning it.
+    Its modules are then importable as resourcehandlers.rhev.<module>.
+    """
+    install(vardir)
+    if APP_NAME in sys.modules:
+        return sys.modules[APP_NAME]
+    spec = importlib.util.spec_from_file_location(
+        APP_NAME, os.path.join(APP_DIR, "__init__.py"),
+        submodule_search_locations=[APP_DIR])
+    app = importlib.util.module_from_spec(spec)
+    sys.modules[APP_NAME] = app
+    spec.loader.exec_module(app)
+    sys.modules["resourcehandlers"].rhev = app
+    return app
+
+
+# Handlers on fake engines
+
+_numbers = itertools.count(1)
+
+
+def make_handler(engine, **settings):
+    """
+    Save a RhevResourceHandler for all of `engine`'s clusters, with
+    `settings` overriding its class attributes, and point its API URL at
+    `engine`. Every handler gets a new id and address, so handlers never
+    share the app's per-handler or per-endpoint state.
+    """
+    import fake_ovirt
+
+    load_app()
+    fake_ovirt.install()
+    from resourcehandlers.rhev.models import RhevResourceHandler
+
+    number = next(_numbers)
+    handler = RhevResourceHandler(
+        name="RHEV {0}".format(number), ip="rhevm{0}.example.com".format(number),
+        clusterName=",".join(c["name"] for c in engine.clusters.values()))
+    for name, value in settings.items():
+        setattr(handler, name, value)
+    handler.save()
+    fake_ovirt.register(engine, handler.get_api_url(
+        handler.protocol, handler.ip, handler.port))
+    return handler
+
+
+def make_servers(handler, engine, count, template_name="template0",
+                 network_count=1):
+    """
+    Save `count` Servers to build on `handler` from the engine's template
+    `template_name`, each on the engine's first `network_count` networks
+    """
+    from resourcehandlers.rhev.models import RhevNetwork
+
+    os_build, _ = OSBuild.objects.get_or_create(name=template_name)
+    if not handler.osbuildattribute_set.filter(os_build=os_build).exists():
+        uuid = [t["id"] for t in engine.templates.values()
+                if t["name"] == template_name][0]
+        handler.add_template_attrs(os_build, template_name, uuid=uuid)
+    handler.add_networks([dict(name=n["name"], network=n["id"], uuid=n["id"])
+                          for n in list(engine.networks.values())[:network_count]])
+    networks = [RhevNetwork.objects.get(uuid=n["id"]) for n in
+                list(engine.networks.values())[:network_count]]
+    number = next(_numbers)
+    return [Server.objects.create(
+        hostname="server{0}-{1}".format(number, i), cpu_cnt=2, mem_size=4,
+        os_build=os_build, networks=networks) for i in range(count)]
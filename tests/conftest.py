@@ -0,0 +1,17 @@
+import pytest
+
+import cloudbolt_stubs
+import fake_ovirt
+
+cloudbolt_stubs.load_app()
+fake_ovirt.install()
+
+
+@pytest.fixture
+def make_handler():
+    return cloudbolt_stubs.make_handler
+
+
+@pytest.fixture
+def make_servers():
+    return cloudbolt_stubs.make_servers
@@ -0,0 +1,740 @@
+"""
+An in-memory stand-in for the part of the ovirtsdk4 API the rhev handler
+uses: the vms, templates, clusters, networks, vnic profiles and events
+services, and the VMs, NICs and disks they return.
+
+A FakeEngine holds an inventory of any size and counts every request by
+operation name, named as instrumentation.py names them (e.g. "vms.list",
+"templates.template.get"). Each request can be made to take `latency`
+seconds, so tests and benchmarks can measure API calls and wall time at
+scale. install() registers the fake as the ovirtsdk4 module; a Connection
+talks to the engine registered for its URL with register().
+"""
+import fnmatch
+import itertools
+import re
+import sys
+import threading
+import time
+import types as pytypes
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+ONE_GIG = 2 ** 30
+
+
+# ovirtsdk4
+
+class Error(Exception):
+    pass
+
+
+class AuthError(Error):
+    pass
+
+
+class ConnectionError(Error):
+    pass
+
+
+class NotFoundError(Error):
+    pass
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def register(engine, url):
+    """
+    Make Connections to `url` talk to `engine`
+    """
+    with _engines_lock:
+        _engines[url] = engine
+
+
+class Connection(object):
+
+    def __init__(self, url=None, username=None, password=None, ca_file=None,
+                 validate_cert_chain=True, **kwargs):
+        with _engines_lock:
+            self._engine = _engines.get(url)
+        if self._engine is None or self._engine.down:
+            raise ConnectionError("No engine at {0}".format(url))
+        self._engine.connections_opened += 1
+        self.closed = False
+
+    def system_service(self):
+        return _SystemService(self._engine)
+
+    def test(self, raise_exception=True):
+        return not self.closed and not self._engine.down
+
+    def close(self):
+        self.closed = True
+
+
+# ovirtsdk4.types
+
+class Struct(object):
+    """
+    An SDK type: any attribute not set reads as None
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return None
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__, ", ".join(
+            "{0}={1!r}".format(k, v) for k, v in sorted(self.__dict__.items())))
+
+
+class Enum(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, Enum) and other.value == self.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __repr__(self):
+        return "Enum({0!r})".format(self.value)
+
+
+TYPE_NAMES = (
+    "Cluster", "Cpu", "CpuTopology", "Disk", "DiskAttachment", "Display",
+    "Event", "Host", "Mac", "Network", "Nic", "OperatingSystem", "Template",
+    "Version", "Vm", "VnicProfile",
+)
+
+
+def _make_types_module():
+    module = pytypes.ModuleType("ovirtsdk4.types")
+    for name in TYPE_NAMES:
+        setattr(module, name, type(name, (Struct,), {}))
+    module.DisplayType = pytypes.SimpleNamespace(SPICE=Enum("spice"), VNC=Enum("vnc"))
+    module.NicInterface = pytypes.SimpleNamespace(VIRTIO=Enum("virtio"))
+    module.VmStatus = Enum
+    module.DiskStatus = Enum
+    return module
+
+
+types = _make_types_module()
+
+
+def install():
+    """
+    Register this module as ovirtsdk4, and its types as ovirtsdk4.types
+    """
+    module = sys.modules.get("ovirtsdk4")
+    if module is not None and getattr(module, "FakeEngine", None) is FakeEngine:
+        return module
+    module = pytypes.ModuleType("ovirtsdk4")
+    for name in ("Error", "AuthError", "ConnectionError", "NotFoundError",
+                 "Connection", "FakeEngine", "register"):
+        setattr(module, name, globals()[name])
+    module.types = types
+    sys.modules["ovirtsdk4"] = module
+    sys.modules["ovirtsdk4.types"] = types
+    return module
+
+
+# Search queries
+
+def parse_search(search):
+    """
+    Parse an engine search query of the forms the handler sends, e.g.
+    'cluster="c1" sortby name asc page 2' or 'id=a or id=b', into
+    (alternatives, sort field, descending, page). Each alternative is a list
+    of (field, pattern) terms that must all match.
+    """
+    match = re.match(r"^(.*?)(?:\s+sortby\s+(\w+)(?:\s+(asc|desc))?)?"
+                     r"(?:\s+page\s+(\d+))?$", (search or "").strip())
+    expr, sortby, order, page = match.groups()
+    alternatives = []
+    for alternative in re.split(r"\s+or\s+", expr) if expr else []:
+        terms = []
+        for term in re.split(r"\s+and\s+", alternative):
+            field, _, pattern = term.partition("=")
+            terms.append((field.strip(), pattern.strip().strip('"')))
+        alternatives.append(terms)
+    return alternatives, sortby, order == "desc", int(page) if page else None
+
+
+def _term_matches(value, pattern):
+    if value is None:
+        return False
+    if "*" in pattern:
+        return fnmatch.fnmatchcase(str(value), pattern)
+    return str(value) == pattern
+
+
+def search_records(records, search, fields, max=None):
+    """
+    Return the records (dicts) matching `search`, sorted and paged as it
+    asks. `fields(record)` returns the dict of searchable field values.
+    """
+    alternatives, sortby, descending, page = parse_search(search)
+    matched = []
+    for record in records:
+        values = fields(record)
+        if not alternatives or any(
+                all(_term_matches(values.get(f), p) for f, p in terms)
+                for terms in alternatives):
+            matched.append((values, record))
+    if sortby:
+        matched.sort(key=lambda m: m[0].get(sortby), reverse=descending)
+    if max is not None:
+        start = (page - 1) * max if page else 0
+        matched = matched[start:start + max]
+    return [record for _, record in matched]
+
+
+# The engine
+
+class FakeEngine(object):
+    """
+    A RHEV-M with `vm_count` VMs spread over `clusters`, built from
+    `template_count` templates, and `network_count` networks each with one
+    vNIC profile.
+
+    `latency`: Seconds each request takes
+    `clone_delay`: Seconds a new VM stays image_locked while its disks copy
+    `power_delay`: Seconds a VM takes to come up after being started
+    `clone_fails`: Whether copying a new VM's disks fails, so that the engine
+    removes the VM after `clone_delay` instead of unlocking it
+    """
+
+    def __init__(self, vm_count=0, template_count=3, clusters=("Default",),
+                 network_count=2, disks_per_vm=1, nics_per_vm=1, latency=0.0,
+                 clone_delay=0.0, power_delay=0.0, clone_fails=False):
+        self.latency = latency
+        self.clone_delay = clone_delay
+        self.clone_fails = clone_fails
+        self.power_delay = power_delay
+        self.calls = Counter()
+        # Errors to raise from the next requests, by operation name
+        self.failures = {}
+        self.connections_opened = 0
+        # Set to refuse connections and fail connection tests
+        self.down = False
+        self._lock = threading.RLock()
+        self._event_ids = itertools.count(1)
+        self._macs = itertools.count(1)
+        # (event id, VM id or None), oldest first
+        self.events = []
+        self.add_event()
+
+        self.clusters = OrderedDict()
+        for name in clusters:
+            self.clusters[str(uuid4())] = dict(name=name)
+        cluster_ids = list(self.clusters)
+
+        self.networks = OrderedDict()
+        self.profiles = OrderedDict()
+        for i in range(network_count):
+            network_id = str(uuid4())
+            self.networks[network_id] = dict(id=network_id, name="net{0}".format(i))
+            profile_id = str(uuid4())
+            self.profiles[profile_id] = dict(id=profile_id, name="net{0}".format(i),
+                                             network_id=network_id)
+
+        self.templates = OrderedDict()
+        for i in range(template_count):
+            self.add_template("template{0}".format(i),
+                              cluster_ids[i % len(cluster_ids)],
+                              os_type="windows_2012" if i % 2 else "rhel_7x64")
+
+        self.vms = OrderedDict()
+        template_ids = list(self.templates) or [None]
+        for i in range(vm_count):
+            self.add_vm("vm{0:06d}".format(i), cluster_ids[i % len(cluster_ids)],
+                        template_ids[i % len(template_ids)], status="up",
+                        disks=disks_per_vm, nics=nics_per_vm)
+
+    # Inventory
+
+    def add_template(self, name, cluster_id, os_type="rhel_7x64", disks=1):
+        template_id = str(uuid4())
+        with self._lock:
+            self.templates[template_id] = dict(
+                id=template_id, name=name, cluster_id=cluster_id,
+                os_type=os_type, memory=2 * ONE_GIG, sockets=2, cores=1,
+                disks=[10 * ONE_GIG] * disks, version=1,
+                creation_time=datetime(2016, 1, 1) + timedelta(
+                    minutes=len(self.templates)))
+        return template_id
+
+    def add_vm(self, name, cluster_id, template_id, status="down", disks=1,
+               nics=1, pending=None):
+        vm_id = str(uuid4())
+        template = self.templates.get(template_id) or {}
+        profile_ids = list(self.profiles)
+        with self._lock:
+            self.vms[vm_id] = dict(
+                id=vm_id, name=name, cluster_id=cluster_id,
+                template_id=template_id, status=status, pending=pending,
+                os_type=template.get("os_type", "other"),
+                memory=template.get("memory", ONE_GIG),
+                sockets=template.get("sockets", 1), cores=1,
+                disks=[[str(uuid4()), 10 * ONE_GIG, "ok"] for _ in range(disks)],
+                nics=[self._new_nic("nic{0}".format(i + 1),
+                                    profile_ids[i % len(profile_ids)]
+                                    if profile_ids else None)
+                      for i in range(nics)])
+        return vm_id
+
+    def remove_vm(self, vm_id):
+        """
+        Remove the VM `vm_id`, as the engine does with a VM whose disks failed
+        to copy
+        """
+        with self._lock:
+            if self.vms.pop(vm_id, None) is not None:
+                self.add_event(vm_id)
+
+    def _new_nic(self, name, profile_id, mac=None):
+        if mac is None:
+            n = next(self._macs)
+            mac = "56:6f:{0:02x}:{1:02x}:{2:02x}:{3:02x}".format(
+                (n >> 24) & 255, (n >> 16) & 255, (n >> 8) & 255, n & 255)
+        return dict(id=str(uuid4()), name=name, profile_id=profile_id, mac=mac)
+
+    def vm_status(self, vm_id):
+        """
+        Return the VM's current status, or None if it does not exist
+        """
+        with self._lock:
+            record = self.vms.get(vm_id)
+            return self._settle(record)["status"] if record else None
+
+    def _settle(self, record):
+        # Apply a pending state change whose time has come
+        pending = record["pending"]
+        if pending and time.time() >= pending[1]:
+            record["status"] = pending[0]
+            record["pending"] = None
+            for disk in record["disks"]:
+                disk[2] = "ok"
+        return record
+
+    def add_event(self, vm_id=None):
+        """
+        Record an engine event, about the VM `vm_id` if given
+        """
+        with self._lock:
+            self.events.append((next(self._event_ids), vm_id))
+
+    # Requests
+
+    def fail_next(self, op, error, times=1):
+        """
+        Make the next `times` requests for `op` raise `error`
+        """
+        with self._lock:
+            self.failures.setdefault(op, []).extend([error] * times)
+
+    def request(self, op):
+        """
+        Count a request for `op` and wait out the configured latency, then
+        raise the error queued for it by fail_next(), if any
+        """
+        with self._lock:
+            self.calls[op] += 1
+            queued = self.failures.get(op)
+            error = queued.pop(0) if queued else None
+        if self.latency:
+            time.sleep(self.latency)
+        if error is not None:
+            raise error
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    @property
+    def call_count(self):
+        return sum(self.calls.values())
+
+    def _vm_fields(self, record):
+        return dict(id=record["id"], name=record["name"],
+                    cluster=self.clusters[record["cluster_id"]]["name"],
+                    status=self._settle(record)["status"])
+
+    def _template_fields(self, record):
+        return dict(id=record["id"], name=record["name"],
+                    cluster=self.clusters[record["cluster_id"]]["name"])
+
+    def _cluster_fields(self, record):
+        return dict(id=record["id"], name=record["name"])
+
+    def vm_obj(self, record, follow=()):
+        record = self._settle(record)
+        vm = types.Vm(
+            id=record["id"], name=record["name"],
+            status=Enum(record["status"]), memory=record["memory"],
+            cpu=types.Cpu(topology=types.CpuTopology(
+                sockets=record["sockets"], cores=record["cores"])),
+            cluster=types.Cluster(id=record["cluster_id"]),
+            template=(types.Template(id=record["template_id"])
+                      if record["template_id"] else None),
+            os=types.OperatingSystem(type=record["os_type"]))
+        if "disk_attachments.disk" in follow:
+            vm.disk_attachments = [
+                types.DiskAttachment(disk=types.Disk(
+                    id=disk_id, provisioned_size=size, status=Enum(status)))
+                for disk_id, size, status in record["disks"]]
+        if "nics" in follow:
+            vm.nics = [self.nic_obj(nic) for nic in record["nics"]]
+        return vm
+
+    def nic_obj(self, nic):
+        return types.Nic(
+            id=nic["id"], name=nic["name"], mac=types.Mac(address=nic["mac"]),
+            vnic_profile=types.VnicProfile(id=nic["profile_id"]))
+
+    def template_obj(self, record, follow=()):
+        template = types.Template(
+            id=record["id"], name=record["name"], memory=record["memory"],
+            cpu=types.Cpu(topology=types.CpuTopology(
+                sockets=record["sockets"], cores=record["cores"])),
+            cluster=types.Cluster(id=record["cluster_id"]),
+            os=types.OperatingSystem(type=record["os_type"]),
+            version=types.Version(version_number=record["version"]),
+            creation_time=record["creation_time"])
+        if "disk_attachments.disk" in follow:
+            template.disk_attachments = [
+                types.DiskAttachment(disk=types.Disk(provisioned_size=size))
+                for size in record["disks"]]
+        return template
+
+
+def _follow(follow):
+    return tuple((follow or "").split(","))
+
+
+class _Future(object):
+
+    def __init__(self, func):
+        try:
+            self._result, self._error = func(), None
+        except Error as e:
+            self._result, self._error = None, e
+
+    def wait(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _Service(object):
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def _send(self, op, func, wait=True):
+        def send():
+            self.engine.request(op)
+            with self.engine._lock:
+                return func()
+        if wait:
+            return send()
+        # As with the real SDK, errors surface when the response is collected
+        return _Future(send)
+
+
+class _SystemService(_Service):
+
+    def vms_service(self):
+        return _VmsService(self.engine)
+
+    def templates_service(self):
+        return _TemplatesService(self.engine)
+
+    def clusters_service(self):
+        return _ClustersService(self.engine)
+
+    def networks_service(self):
+        return _NetworksService(self.engine, "networks")
+
+    def vnic_profiles_service(self):
+        return _VnicProfilesService(self.engine)
+
+    def events_service(self):
+        return _EventsService(self.engine)
+
+
+class _VmsService(_Service):
+
+    def list(self, search=None, max=None, follow=None, **kwargs):
+        engine = self.engine
+
+        def list_vms():
+            return [engine.vm_obj(record, _follow(follow)) for record in
+                    search_records(engine.vms.values(), search,
+                                   engine._vm_fields, max)]
+        return self._send("vms.list", list_vms)
+
+    def add(self, vm, query=None, wait=True, **kwargs):
+        engine = self.engine
+
+        def add_vm():
+            if any(r["name"] == vm.name for r in engine.vms.values()):
+                raise Error("VM name {0} is already in use".format(vm.name))
+            template = engine.templates.get(vm.template.id)
+            if template is None:
+                raise NotFoundError("No template {0}".format(vm.template.id))
+            cluster_id = vm.cluster.id
+            vm_id = engine.add_vm(
+                vm.name, cluster_id, template["id"], status="image_locked",
+                disks=len(template["disks"]), nics=0,
+                pending=(None if engine.clone_fails else
+                         ("down", time.time() + engine.clone_delay)))
+            record = engine.vms[vm_id]
+            for disk in record["disks"]:
+                disk[2] = "locked"
+            _update_vm(record, vm)
+            engine.add_event(vm_id)
+            if engine.clone_fails:
+                timer = threading.Timer(engine.clone_delay, engine.remove_vm,
+                                        [vm_id])
+                timer.daemon = True
+                timer.start()
+            return engine.vm_obj(record)
+        return self._send("vms.add", add_vm, wait)
+
+    def vm_service(self, vm_id):
+        return _VmService(self.engine, vm_id)
+
+
+def _update_vm(record, vm):
+    if vm.name:
+        record["name"] = vm.name
+    if vm.memory:
+        record["memory"] = int(vm.memory)
+    if vm.cpu and vm.cpu.topology:
+        record["sockets"] = vm.cpu.topology.sockets or record["sockets"]
+        record["cores"] = vm.cpu.topology.cores or record["cores"]
+
+
+class _VmService(_Service):
+
+    def __init__(self, engine, vm_id):
+        super(_VmService, self).__init__(engine)
+        self.vm_id = vm_id
+
+    def _record(self):
+        record = self.engine.vms.get(self.vm_id)
+        if record is None:
+            raise NotFoundError("No VM {0}".format(self.vm_id))
+        return self.engine._settle(record)
+
+    def get(self, follow=None, **kwargs):
+        return self._send("vms.vm.get", lambda: self.engine.vm_obj(
+            self._record(), _follow(follow)))
+
+    def update(self, vm, query=None, wait=True, **kwargs):
+        def update():
+            record = self._record()
+            _update_vm(record, vm)
+            self.engine.add_event(self.vm_id)
+            return self.engine.vm_obj(record)
+        return self._send("vms.vm.update", update, wait)
+
+    def start(self, wait=True, **kwargs):
+        def start():
+            record = self._record()
+            if record["status"] == "image_locked":
+                raise Error("Cannot run VM. VM is being created")
+            if record["status"] != "up":
+                if self.engine.power_delay:
+                    record["status"] = "powering_up"
+                    record["pending"] = ("up", time.time() + self.engine.power_delay)
+                else:
+                    record["status"] = "up"
+            self.engine.add_event(self.vm_id)
+        return self._send("vms.vm.start", start, wait)
+
+    def stop(self, wait=True, **kwargs):
+        def stop():
+            record = self._record()
+            if record["status"] == "image_locked":
+                raise Error("Cannot stop VM. VM is being created")
+            record["status"], record["pending"] = "down", None
+            self.engine.add_event(self.vm_id)
+        return self._send("vms.vm.stop", stop, wait)
+
+    def remove(self, wait=True, **kwargs):
+        def remove():
+            record = self._record()
+            if record["status"] not in ("down", "image_illegal"):
+                raise Error("Cannot remove VM. VM is running")
+            del self.engine.vms[self.vm_id]
+            self.engine.add_event(self.vm_id)
+        return self._send("vms.vm.remove", remove, wait)
+
+    def nics_service(self):
+        return _NicsService(self.engine, self)
+
+
+class _NicsService(_Service):
+
+    def __init__(self, engine, vm_service):
+        super(_NicsService, self).__init__(engine)
+        self.vm_service = vm_service
+
+    def _unlocked_record(self):
+        record = self.vm_service._record()
+        if record["status"] == "image_locked":
+            raise Error("Cannot change NICs. VM is being created")
+        return record
+
+    def list(self, **kwargs):
+        return self._send("vms.vm.nics.list", lambda: [
+            self.engine.nic_obj(nic) for nic in self.vm_service._record()["nics"]])
+
+    def add(self, nic, wait=True, **kwargs):
+        def add():
+            record = self._unlocked_record()
+            new_nic = self.engine._new_nic(
+                nic.name, nic.vnic_profile.id if nic.vnic_profile else None,
+                nic.mac.address if nic.mac else None)
+            record["nics"].append(new_nic)
+            self.engine.add_event(record["id"])
+            return self.engine.nic_obj(new_nic)
+        return self._send("vms.vm.nics.add", add, wait)
+
+    def nic_service(self, nic_id):
+        return _NicService(self.engine, self, nic_id)
+
+
+class _NicService(_Service):
+
+    def __init__(self, engine, nics_service, nic_id):
+        super(_NicService, self).__init__(engine)
+        self.nics_service = nics_service
+        self.nic_id = nic_id
+
+    def _find(self, record):
+        for nic in record["nics"]:
+            if nic["id"] == self.nic_id:
+                return nic
+        raise NotFoundError("No NIC {0}".format(self.nic_id))
+
+    def update(self, nic, wait=True, **kwargs):
+        def update():
+            record = self.nics_service._unlocked_record()
+            found = self._find(record)
+            if nic.vnic_profile:
+                found["profile_id"] = nic.vnic_profile.id
+            self.engine.add_event(record["id"])
+            return self.engine.nic_obj(found)
+        return self._send("vms.vm.nics.nic.update", update, wait)
+
+    def remove(self, wait=True, **kwargs):
+        def remove():
+            record = self.nics_service._unlocked_record()
+            record["nics"].remove(self._find(record))
+            self.engine.add_event(record["id"])
+        return self._send("vms.vm.nics.nic.remove", remove, wait)
+
+
+class _TemplatesService(_Service):
+
+    def list(self, search=None, max=None, follow=None, **kwargs):
+        engine = self.engine
+
+        def list_templates():
+            return [engine.template_obj(record, _follow(follow)) for record in
+                    search_records(engine.templates.values(), search,
+                                   engine._template_fields, max)]
+        return self._send("templates.list", list_templates)
+
+    def template_service(self, template_id):
+        return _TemplateService(self.engine, template_id)
+
+
+class _TemplateService(_Service):
+
+    def __init__(self, engine, template_id):
+        super(_TemplateService, self).__init__(engine)
+        self.template_id = template_id
+
+    def get(self, follow=None, **kwargs):
+        def get():
+            record = self.engine.templates.get(self.template_id)
+            if record is None:
+                raise NotFoundError("No template {0}".format(self.template_id))
+            return self.engine.template_obj(record, _follow(follow))
+        return self._send("templates.template.get", get)
+
+
+class _ClustersService(_Service):
+
+    def list(self, search=None, max=None, **kwargs):
+        engine = self.engine
+        records = [dict(record, id=cluster_id)
+                   for cluster_id, record in engine.clusters.items()]
+        return self._send("clusters.list", lambda: [
+            types.Cluster(id=record["id"], name=record["name"])
+            for record in search_records(records, search,
+                                         engine._cluster_fields, max)])
+
+    def cluster_service(self, cluster_id):
+        return _ClusterService(self.engine, cluster_id)
+
+
+class _ClusterService(_Service):
+
+    def __init__(self, engine, cluster_id):
+        super(_ClusterService, self).__init__(engine)
+        self.cluster_id = cluster_id
+
+    def networks_service(self):
+        return _NetworksService(self.engine, "clusters.cluster.networks")
+
+
+class _NetworksService(_Service):
+
+    def __init__(self, engine, op_path):
+        super(_NetworksService, self).__init__(engine)
+        self.op_path = op_path
+
+    def list(self, **kwargs):
+        return self._send(self.op_path + ".list", lambda: [
+            types.Network(id=record["id"], name=record["name"])
+            for record in self.engine.networks.values()])
+
+
+class _VnicProfilesService(_Service):
+
+    def list(self, **kwargs):
+        return self._send("vnic_profiles.list", lambda: [
+            types.VnicProfile(id=record["id"], name=record["name"],
+                              network=types.Network(id=record["network_id"]))
+            for record in self.engine.profiles.values()])
+
+
+class _EventsService(_Service):
+
+    def list(self, from_=None, max=None, **kwargs):
+        def list_events():
+            # Newest first, as the engine lists them
+            events = [(event_id, vm_id) for event_id, vm_id
+                      in reversed(self.engine.events)
+                      if from_ is None or event_id > int(from_)]
+            if max is not None:
+                events = events[:max]
+            return [types.Event(id=str(event_id),
+                                vm=types.Vm(id=vm_id) if vm_id else None)
+                    for event_id, vm_id in events]
+        return self._send("events.list", list_events)
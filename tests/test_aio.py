@@ -0,0 +1,33 @@
+import asyncio
+
+import fake_ovirt
+
+
+def test_operation_threads_give_their_connections_back(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine(latency=0.01)
+    handler = make_handler(engine, connection_pool_size=4)
+    servers = make_servers(handler, engine, 6)
+    cluster_id = next(iter(engine.clusters))
+    for server in servers:
+        server.resource_handler_svr_id = engine.add_vm(server.hostname, cluster_id, None)
+        server.save()
+    ops = handler.get_async_operations()
+
+    async def power_on_all():
+        return await asyncio.gather(*[ops.poweron(server.id, wait=True)
+                                      for server in servers])
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(power_on_all())
+    finally:
+        loop.close()
+    threads = list(ops._executor._threads)
+    ops.close()
+
+    assert results == [True] * len(servers)
+    # Fewer threads than connections, leaving some for the caller and the
+    # status watcher, and none kept by a thread once its operation is done
+    assert len(threads) <= handler.worker_pool_size < handler.connection_pool_size
+    leased = set(handler.connection_pool._leases)
+    assert not leased & set(thread.ident for thread in threads)
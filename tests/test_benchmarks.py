@@ -0,0 +1,35 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "benchmarks"))
+
+import bench_handler  # noqa: E402
+import bench_import  # noqa: E402
+
+
+def test_handler_benchmarks_write_a_json_line_each(tmpdir):
+    output = str(tmpdir.join("results.jsonl"))
+
+    bench_handler.main(["--sizes", "20,40", "--servers", "2", "--output", output])
+
+    with open(output) as f:
+        results = [json.loads(line) for line in f]
+    assert ([(r["benchmark"], r["vms"]) for r in results] ==
+            [(name, size) for size in (20, 40) for name, _, _ in bench_handler.BENCHMARKS])
+    for result in results:
+        assert result["api_calls"] == sum(result["calls_by_op"].values()) > 0
+        assert result["seconds"] >= 0
+
+
+def test_import_benchmark_reports_the_app_without_the_sdk(tmpdir):
+    output = str(tmpdir.join("results.jsonl"))
+
+    bench_import.main(["--repeat", "1", "--output", output])
+
+    with open(output) as f:
+        results = dict((r["benchmark"], r) for r in map(json.loads, f))
+    assert results["import_app"]["seconds"] > 0
+    assert results["import_app"]["sdk_loaded"] is False
+    assert "import_sdk" in results
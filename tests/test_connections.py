@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+import fake_ovirt
+from resourcehandlers.rhev.connections import ConnectionPool
+
+_urls = iter(range(1, 1000000))
+
+
+def make_pool(size, **kwargs):
+    engine = fake_ovirt.FakeEngine()
+    url = "https://pool{0}.example.com:443/api".format(next(_urls))
+    fake_ovirt.register(engine, url)
+    return engine, ConnectionPool(dict(url=url), size, acquire_timeout=1, **kwargs)
+
+
+def test_failed_reconnects_give_their_slots_back():
+    # Every idle connection is health checked, and reconnecting fails while
+    # the engine is down
+    engine, pool = make_pool(2, health_check_interval=-1)
+    for connection in [pool.acquire(), pool.acquire()]:
+        pool.release(connection)
+
+    engine.down = True
+    for _ in range(2):
+        with pytest.raises(fake_ovirt.ConnectionError):
+            pool.acquire()
+    engine.down = False
+
+    connections = [pool.acquire(), pool.acquire()]
+    assert not [c for c in connections if c.closed]
+
+
+def test_failed_reconnect_drops_the_threads_lease():
+    engine, pool = make_pool(1, health_check_interval=-1)
+    pool.get_for_current_thread()
+
+    engine.down = True
+    with pytest.raises(fake_ovirt.ConnectionError):
+        pool.get_for_current_thread()
+    engine.down = False
+    pool.release_current_thread()
+
+    # No dead connection was put back on the idle list, where it would be
+    # handed out unchecked until the next health check is due
+    pool.health_check_interval = 60
+    assert not pool.get_for_current_thread().closed
+    pool.release_current_thread()
+    assert not pool.acquire().closed
+
+
+def test_leases_of_exited_threads_are_reclaimed():
+    engine, pool = make_pool(1)
+    thread = threading.Thread(target=pool.get_for_current_thread)
+    thread.start()
+    thread.join()
+
+    # The thread never released its connection, but has exited
+    connection = pool.acquire()
+
+    assert not connection.closed
+    assert engine.connections_opened == 1
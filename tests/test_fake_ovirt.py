@@ -0,0 +1,79 @@
+import time
+
+import fake_ovirt
+
+
+def engine_system(engine):
+    url = "https://fake-{0}/api".format(id(engine))
+    fake_ovirt.register(engine, url)
+    return fake_ovirt.Connection(url=url).system_service()
+
+
+def test_search_pages_sorted_by_name():
+    engine = fake_ovirt.FakeEngine(vm_count=25, clusters=("c1", "c2"))
+    vms_service = engine_system(engine).vms_service()
+
+    pages = [vms_service.list(search='cluster="c1" sortby name asc page {0}'.format(page),
+                              max=5)
+             for page in (1, 2, 3)]
+
+    names = [vm.name for page in pages for vm in page]
+    assert [len(page) for page in pages] == [5, 5, 3]
+    assert names == sorted(names)
+    assert engine.calls["vms.list"] == 3
+
+
+def test_search_or_and_wildcards():
+    engine = fake_ovirt.FakeEngine(vm_count=3)
+    vm_ids = list(engine.vms)
+    engine.add_vm("cbwarm-t1-0001", next(iter(engine.clusters)), None)
+    vms_service = engine_system(engine).vms_service()
+
+    by_id = vms_service.list(search="id={0} or id={1}".format(*vm_ids[:2]))
+    warm = vms_service.list(search='name=cbwarm-t1-* and cluster="Default" and status=down')
+
+    assert sorted(vm.id for vm in by_id) == sorted(vm_ids[:2])
+    assert [vm.name for vm in warm] == ["cbwarm-t1-0001"]
+
+
+def test_links_only_returned_when_followed():
+    engine = fake_ovirt.FakeEngine(vm_count=1)
+    vms_service = engine_system(engine).vms_service()
+
+    plain, = vms_service.list()
+    followed, = vms_service.list(follow="disk_attachments.disk,nics")
+
+    assert plain.disk_attachments is None and plain.nics is None
+    assert len(followed.disk_attachments) == 1 and len(followed.nics) == 1
+
+
+def test_clone_is_image_locked_until_copied():
+    engine = fake_ovirt.FakeEngine(clone_delay=60)
+    cluster_id = next(iter(engine.clusters))
+    template_id = next(iter(engine.templates))
+    vms_service = engine_system(engine).vms_service()
+
+    vm = vms_service.add(fake_ovirt.types.Vm(
+        name="new", cluster=fake_ovirt.types.Cluster(id=cluster_id),
+        template=fake_ovirt.types.Template(id=template_id)))
+
+    assert engine.vm_status(vm.id) == "image_locked"
+    try:
+        vms_service.vm_service(vm.id).start()
+    except fake_ovirt.Error:
+        pass
+    else:
+        raise AssertionError("started a VM whose disks are locked")
+
+
+def test_latency_applies_per_request():
+    engine = fake_ovirt.FakeEngine(latency=0.05)
+    events_service = engine_system(engine).events_service()
+
+    start = time.time()
+    events_service.list(max=1)
+    events_service.list(max=1)
+
+    assert time.time() - start >= 0.1
+    assert engine.call_count == 2
+
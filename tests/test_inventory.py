@@ -0,0 +1,65 @@
+import os
+from decimal import Decimal
+
+import fake_ovirt
+from resourcehandlers.rhev.inventory_store import InventoryStore, WRITE_BATCH
+
+
+def test_saved_inventory_has_the_same_types_as_live(make_handler):
+    engine = fake_ovirt.FakeEngine(vm_count=5)
+    handler = make_handler(engine)
+    live_vms = handler.get_all_vms()
+    live_templates = handler.discover_templates()[0]
+    engine.reset_calls()
+
+    saved_vms = handler.get_inventory("vms")
+    saved_templates = handler.get_inventory("templates")
+
+    assert engine.call_count == 0
+    assert saved_vms == live_vms
+    assert saved_templates == live_templates
+    assert all(isinstance(t["mem_size"], Decimal) for t in saved_templates)
+    assert [vm["os_family"].name for vm in saved_vms] == \
+        [vm["os_family"].name for vm in live_vms]
+
+
+def test_store_round_trips_sections_larger_than_a_write_batch(tmpdir):
+    store = InventoryStore(str(tmpdir.join("inventory", "1")))
+    vms = [dict(id=str(i), name="vm{0}".format(i), mem_size=Decimal(i))
+           for i in range(2 * WRITE_BATCH + 1)]
+    networks = [dict(id="n1", name="neté1")]
+
+    store.write("networks", networks)
+    store.write("vms", vms)
+    store.write("templates", [])
+
+    assert store.read("networks", 60) == networks
+    assert store.read("vms", 60) == [dict(vm, mem_size=str(vm["mem_size"]))
+                                     for vm in vms]
+    assert store.read("templates", 60) == []
+
+
+def test_incremental_syncs_only_rewrite_the_vms_when_they_changed(make_handler,
+                                                                  monkeypatch):
+    engine = fake_ovirt.FakeEngine(vm_count=5)
+    handler = make_handler(engine, incremental_vm_sync=True)
+    handler.get_all_networks()
+    handler.get_all_vms()
+    store = handler.inventory_store
+    networks_written = store.fetched_at("networks")
+    written = []
+    monkeypatch.setattr(InventoryStore, "write",
+                        lambda self, section, items: written.append(section))
+
+    # An event about a VM that has not changed: the saved VMs are only
+    # marked as fetched now
+    os.utime(store.path("vms"), (0, 0))
+    engine.add_event(next(iter(engine.vms)))
+    handler.get_all_vms()
+    assert written == []
+    assert store.read("vms", 60) is not None
+
+    engine.add_event(engine.add_vm("new", next(iter(engine.clusters)), None))
+    handler.get_all_vms()
+    assert written == ["vms"]
+    assert store.fetched_at("networks") == networks_written
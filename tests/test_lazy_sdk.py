@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Run in a new interpreter, since this one has the fake SDK installed
+IMPORT_APP = """
+import json
+import sys
+
+import cloudbolt_stubs
+
+cloudbolt_stubs.load_app()
+import resourcehandlers.rhev.admin
+import resourcehandlers.rhev.cb_rhevapi_common
+import resourcehandlers.rhev.forms
+import resourcehandlers.rhev.models
+import resourcehandlers.rhev.views
+from resourcehandlers.rhev.lazy_sdk import sdk, types
+
+print(json.dumps(dict(
+    sdk_loaded=sdk.is_loaded(), types_loaded=types.is_loaded(),
+    sdk_modules=[m for m in sys.modules if m.split(".")[0] == "ovirtsdk4"])))
+"""
+
+
+def test_app_imports_without_loading_the_sdk():
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_APP],
+                                     cwd=TESTS_DIR)
+
+    result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    assert not result["sdk_loaded"]
+    assert not result["types_loaded"]
+    assert result["sdk_modules"] == []
+
+
+def test_sdk_is_imported_on_first_use():
+    from resourcehandlers.rhev.lazy_sdk import LazyModule
+
+    module = LazyModule("json")
+
+    assert not module.is_loaded()
+    assert module.dumps([]) == "[]"
+    assert module.is_loaded()
@@ -0,0 +1,71 @@
+import threading
+
+import fake_ovirt
+from infrastructure.models import ServerNetworkCard
+
+
+def make_servers_with_vms(make_servers, handler, engine, count):
+    servers = make_servers(handler, engine, count, network_count=2)
+    cluster_id = next(iter(engine.clusters))
+    for server in servers:
+        server.resource_handler_svr_id = engine.add_vm(
+            server.hostname, cluster_id, None, nics=0)
+        server.save()
+    return servers
+
+
+def test_add_nics_to_server_adds_one_nic_per_network(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine(network_count=2)
+    handler = make_handler(engine)
+    server, = make_servers_with_vms(make_servers, handler, engine, 1)
+
+    handler.add_nics_to_server(server.id)
+
+    nics = engine.vms[server.resource_handler_svr_id]["nics"]
+    assert sorted(nic["name"] for nic in nics) == ["nic1", "nic2"]
+    assert engine.calls["vms.vm.nics.add"] == 2
+
+
+def test_concurrent_nic_changes_do_not_exhaust_the_pool(make_handler, make_servers):
+    # More jobs than connections, each fanning out to more workers than
+    # there are connections: none may hold a lease while its workers wait
+    engine = fake_ovirt.FakeEngine(network_count=2, latency=0.01)
+    handler = make_handler(engine, connection_pool_size=2)
+    # Fail rather than hang if the pool does run dry
+    handler.connection_pool.acquire_timeout = 5
+    servers = make_servers_with_vms(make_servers, handler, engine, 4)
+    errors = []
+
+    def add_nics(server):
+        try:
+            handler.add_nics_to_server(server.id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            handler.release_connection()
+
+    threads = [threading.Thread(target=add_nics, args=(server,)) for server in servers]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert not [thread for thread in threads if thread.is_alive()]
+    assert errors == []
+    for server in servers:
+        assert len(engine.vms[server.resource_handler_svr_id]["nics"]) == 2
+
+
+def test_reconciling_again_keeps_the_recorded_macs(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine(network_count=2)
+    handler = make_handler(engine)
+    server, = make_servers_with_vms(make_servers, handler, engine, 1)
+
+    handler.add_nics_to_server(server.id)
+    handler.add_nics_to_server(server.id)
+
+    nics = engine.vms[server.resource_handler_svr_id]["nics"]
+    recorded = ServerNetworkCard.objects.filter(server=server)
+    assert sorted(nic.mac for nic in recorded) == sorted(nic["mac"] for nic in nics)
+    assert engine.calls["vms.vm.nics.add"] == 2
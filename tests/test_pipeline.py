@@ -0,0 +1,63 @@
+import threading
+import time
+
+import fake_ovirt
+
+
+def test_provision_resources_builds_servers_end_to_end(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine(network_count=2)
+    handler = make_handler(engine, connection_pool_size=4)
+    servers = make_servers(handler, engine, 5, network_count=2)
+
+    results = handler.provision_resources([server.id for server in servers])
+
+    assert all(results[server.id] for server in servers), results
+    for server in servers:
+        vm_id = server.resource_handler_svr_id
+        assert engine.vm_status(vm_id) == "up"
+        assert len(engine.vms[vm_id]["nics"]) == 2
+
+
+def test_provision_resources_times_out_waits(make_handler, make_servers):
+    # The disks never finish copying; the wait must expire rather than hang
+    engine = fake_ovirt.FakeEngine(clone_delay=3600)
+    handler = make_handler(engine, image_lock_timeout=1)
+    server, = make_servers(handler, engine, 1)
+
+    results = handler.provision_resources([server.id])
+
+    assert not results[server.id]
+    assert "waiting for disks" in results[server.id].message
+
+
+def test_provision_resources_fails_at_once_when_the_clone_is_removed(
+        make_handler, make_servers):
+    # The engine removes a VM whose disks failed to copy; the wait for the
+    # disks must fail then instead of running out its timeout
+    engine = fake_ovirt.FakeEngine(clone_delay=0.5, clone_fails=True)
+    handler = make_handler(engine, image_lock_timeout=10)
+    server, = make_servers(handler, engine, 1)
+
+    start = time.time()
+    results = handler.provision_resources([server.id])
+
+    assert time.time() - start < 5
+    assert not results[server.id]
+    assert "waiting for disks: VM was removed" in results[server.id].message
+
+
+def test_configure_network_does_not_start_a_removed_clone(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine()
+    handler = make_handler(engine, image_lock_timeout=10)
+    server, = make_servers(handler, engine, 1)
+    server.resource_handler_svr_id = engine.add_vm(
+        server.hostname, next(iter(engine.clusters)), None, status="image_locked")
+    server.save()
+    timer = threading.Timer(0.5, engine.remove_vm, [server.resource_handler_svr_id])
+    timer.start()
+
+    start = time.time()
+    handler.configure_network(server.id)
+
+    assert time.time() - start < 5
+    assert engine.calls["vms.vm.start"] == 0
@@ -0,0 +1,69 @@
+import pytest
+
+import fake_ovirt
+
+
+def make_servers_with_vms(make_servers, handler, engine, count, status="down"):
+    servers = make_servers(handler, engine, count)
+    cluster_id = next(iter(engine.clusters))
+    for server in servers:
+        server.resource_handler_svr_id = engine.add_vm(
+            server.hostname, cluster_id, None, status=status)
+        server.save()
+    return servers
+
+
+def test_power_on_keeps_at_most_per_host_vms_in_transition(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine(power_delay=0.2)
+    handler = make_handler(engine)
+    servers = make_servers_with_vms(make_servers, handler, engine, 3)
+    vm_ids = [server.resource_handler_svr_id for server in servers]
+    # The number of VMs already powering up when each start is sent
+    transitions = []
+    request = engine.request
+
+    def counting_request(op):
+        if op == "vms.vm.start":
+            transitions.append(len([vm_id for vm_id in vm_ids
+                                    if engine.vm_status(vm_id) == "powering_up"]))
+        request(op)
+    engine.request = counting_request
+
+    results = handler.poweron_resources([server.id for server in servers], per_host=1)
+
+    assert all(results[server.id] for server in servers), results
+    assert transitions == [0, 0, 0]
+
+
+def test_power_on_reports_servers_that_do_not_exist(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine()
+    handler = make_handler(engine)
+    server, = make_servers_with_vms(make_servers, handler, engine, 1, status="up")
+
+    results = handler.poweron_resources([server.id, -1])
+
+    assert results[server.id]
+    assert not results[-1]
+    assert "does not exist" in results[-1].message
+
+
+def test_power_on_stops_watching_when_a_request_raises(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine(power_delay=60)
+    handler = make_handler(engine)
+    servers = make_servers_with_vms(make_servers, handler, engine, 2)
+    # The first VM starts, then the request for the second raises
+    starts = []
+    request = engine.request
+
+    def failing_request(op):
+        request(op)
+        if op == "vms.vm.start":
+            starts.append(op)
+            if len(starts) == 2:
+                raise RuntimeError("circuit open")
+    engine.request = failing_request
+
+    with pytest.raises(RuntimeError):
+        handler.poweron_resources([server.id for server in servers], per_host=2)
+
+    assert handler.status_watcher._waiters == {}
@@ -0,0 +1,48 @@
+import pytest
+
+import fake_ovirt
+from resourcehandlers.rhev.models import RhevOSBuildAttribute
+from utilities.exceptions import CloudBoltException
+
+
+def test_create_resources_reports_failures_per_server(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine()
+    handler = make_handler(engine)
+    servers = make_servers(handler, engine, 3)
+    no_template, = make_servers(handler, engine, 1, template_name="template1")
+    RhevOSBuildAttribute.objects.filter(os_build=no_template.os_build).delete()
+    engine.fail_next("vms.add", RuntimeError("connection reset"))
+
+    results = handler.create_resources([s.id for s in servers + [no_template]])
+
+    assert "No template is set up" in results[no_template.id].message
+    failed = [s.id for s in servers if not results[s.id]]
+    assert len(failed) == 1
+    assert results[failed[0]].message == "connection reset"
+    assert engine.calls["vms.add"] == 3
+    assert len(engine.vms) == 2
+
+
+def test_task_statuses_report_disk_copy_progress_and_failures(make_handler, make_servers):
+    engine = fake_ovirt.FakeEngine(clone_delay=3600)
+    handler = make_handler(engine)
+    copying, copied, removed = make_servers(handler, engine, 3)
+    tasks = [handler.create_resource(server.id, None)
+             for server in (copying, copied, removed)]
+    vm_ids = [task.split(":", 1)[0] for task in tasks]
+    # Half of one VM's disks are done copying, another has finished and the
+    # last failed and was removed
+    engine.vms[vm_ids[0]]["disks"] = [[str(i), 1, status]
+                                      for i, status in enumerate(["ok", "locked"])]
+    engine.vms[vm_ids[1]]["pending"] = ("down", 0)
+    engine.remove_vm(vm_ids[2])
+
+    statuses = handler.get_task_statuses(tasks)
+
+    assert statuses[tasks[0]] == (False, 49)
+    assert statuses[tasks[1]] == (True, 100)
+    assert isinstance(statuses[tasks[2]], CloudBoltException)
+    assert handler.is_task_complete(copying.id, tasks[0]) == (False, 49)
+    with pytest.raises(CloudBoltException) as error:
+        handler.is_task_complete(removed.id, tasks[2])
+    assert "no longer exists" in str(error.value)
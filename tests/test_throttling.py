@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import pytest
+
+import fake_ovirt
+from resourcehandlers.rhev.throttling import (
+    CircuitBreaker, CircuitOpenError, TokenBucket)
+
+
+def test_token_bucket_allows_a_burst_then_limits_the_rate():
+    bucket = TokenBucket(rate=20, burst=5)
+
+    start = time.time()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.time() - start < 0.05
+
+    for _ in range(4):
+        bucket.acquire()
+    assert time.time() - start >= 0.15
+
+
+def test_circuit_breaker_opens_and_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    breaker.record_failure("engine")
+    breaker.before_call("engine")
+    breaker.record_failure("engine")
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("engine")
+
+    # After the timeout one probe goes through; a failed probe reopens
+    time.sleep(0.25)
+    breaker.before_call("engine")
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("engine")
+    breaker.record_failure("engine")
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("engine")
+
+    # A successful probe closes the circuit
+    time.sleep(0.25)
+    breaker.before_call("engine")
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call("engine")
+
+
+def make_vms(engine, count):
+    cluster_id = next(iter(engine.clusters))
+    return [engine.add_vm("vm{0}".format(i), cluster_id, None) for i in range(count)]
+
+
+def start_vms(handler, vm_ids):
+    ops = handler.get_async_operations()
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(ops.start_vms(vm_ids))
+    finally:
+        loop.close()
+        ops.close()
+
+
+def test_bulk_requests_stay_within_the_in_flight_cap(make_handler):
+    engine = fake_ovirt.FakeEngine()
+    handler = make_handler(engine, api_max_in_flight=2)
+    guard = handler.endpoint_guard
+    vm_ids = make_vms(engine, 5)
+    counts = dict(now=0, peak=0)
+    acquire, release = guard.acquire, guard.release
+
+    def counting_acquire():
+        acquire()
+        counts["now"] += 1
+        counts["peak"] = max(counts["peak"], counts["now"])
+
+    def counting_release(error=None):
+        counts["now"] -= 1
+        release(error)
+
+    guard.acquire, guard.release = counting_acquire, counting_release
+
+    errors = start_vms(handler, vm_ids)
+
+    assert errors == dict.fromkeys(vm_ids)
+    assert counts == dict(now=0, peak=2)
+
+
+def test_bulk_request_failures_reach_the_circuit_breaker(make_handler):
+    engine = fake_ovirt.FakeEngine()
+    handler = make_handler(engine, circuit_failure_threshold=2)
+    vm_ids = make_vms(engine, 2)
+    engine.fail_next("vms.vm.start", fake_ovirt.ConnectionError("reset"), times=2)
+
+    errors = start_vms(handler, vm_ids)
+
+    assert all(isinstance(errors[vm_id], fake_ovirt.ConnectionError)
+               for vm_id in vm_ids)
+    assert handler.endpoint_guard.breaker.state == CircuitBreaker.OPEN
+    stats = handler.call_stats.snapshot()["vms.vm.start"]
+    assert stats["errors"] == 2
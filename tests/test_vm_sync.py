@@ -0,0 +1,40 @@
+import fake_ovirt
+
+
+def sync_all_vms(make_handler, vm_count):
+    engine = fake_ovirt.FakeEngine(vm_count=vm_count, template_count=3)
+    # One page holds every VM, so only the number of VMs differs
+    handler = make_handler(engine, vm_page_size=2000)
+    vms = handler.get_all_vms(incremental=False)
+    assert len(vms) == vm_count
+    return vms, dict(engine.calls)
+
+
+def test_full_sync_api_calls_do_not_grow_with_vm_count(make_handler):
+    _, small = sync_all_vms(make_handler, 10)
+    _, large = sync_all_vms(make_handler, 1000)
+
+    assert small == large
+    assert small["vms.list"] == 1
+    # Each distinct template is fetched once, however many VMs use it
+    assert small["templates.template.get"] == 3
+    assert set(small) == {"events.list", "vms.list", "templates.template.get"}
+
+
+def test_full_sync_reads_disks_and_nics_from_followed_links(make_handler):
+    vms, calls = sync_all_vms(make_handler, 10)
+
+    for vm_dict in vms:
+        assert vm_dict["disk_size"] == 10
+        assert vm_dict["mac"].startswith("56:6f:")
+        assert vm_dict["os_family"].name in ("Linux", "Windows")
+    assert not [op for op in calls if op.startswith("vms.vm.")]
+
+
+def test_full_sync_api_calls_grow_with_pages(make_handler):
+    engine = fake_ovirt.FakeEngine(vm_count=1000, template_count=3)
+    handler = make_handler(engine, vm_page_size=100)
+
+    assert len(handler.get_all_vms(incremental=False)) == 1000
+    # Ten full pages, then an empty one that ends the listing
+    assert engine.calls["vms.list"] == 11
@@ -0,0 +1,56 @@
+import threading
+
+import fake_ovirt
+from resourcehandlers.rhev.models import RhevWarmVmClaim
+from resourcehandlers.rhev.warm_pool import WARM_VM_PREFIX
+
+
+def setup_pool(make_handler, engine, vm_count):
+    handler = make_handler(engine)
+    template = handler.get_template_by_name("template0")
+    cluster = handler.get_cluster()
+    vm_ids = [engine.add_vm("{0}{1}-{2}".format(WARM_VM_PREFIX, template.id, i),
+                            cluster.id, template.id)
+              for i in range(vm_count)]
+    return handler, template, cluster, vm_ids
+
+
+def claim(handler, template, cluster, name):
+    return handler.warm_pool.claim(
+        handler, template, cluster,
+        fake_ovirt.types.Vm(name=name, memory=fake_ovirt.ONE_GIG), "correlation")
+
+
+def test_claim_skips_vms_claimed_by_another_process(make_handler):
+    engine = fake_ovirt.FakeEngine()
+    handler, template, cluster, vm_ids = setup_pool(make_handler, engine, 2)
+    RhevWarmVmClaim.objects.create(vm_id=vm_ids[0])
+
+    claimed = claim(handler, template, cluster, "server1")
+
+    assert claimed == vm_ids[1]
+    assert engine.vms[claimed]["name"] == "server1"
+    assert claim(handler, template, cluster, "server2") is None
+
+
+def test_concurrent_claims_hand_out_each_vm_once(make_handler):
+    # With latency, every claimant lists the pool before any renames a VM
+    engine = fake_ovirt.FakeEngine(latency=0.05)
+    handler, template, cluster, vm_ids = setup_pool(make_handler, engine, 1)
+    results = []
+
+    def claim_on_thread(name):
+        try:
+            results.append(claim(handler, template, cluster, name))
+        finally:
+            handler.release_connection()
+
+    threads = [threading.Thread(target=claim_on_thread, args=("server{0}".format(i),))
+               for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert sorted(results, key=str) == sorted([vm_ids[0], None, None], key=str)
+    assert engine.calls["vms.vm.update"] == 1
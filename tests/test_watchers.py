@@ -0,0 +1,28 @@
+import fake_ovirt
+from resourcehandlers.rhev.watchers import ABSENT
+
+
+def test_wait_for_vm_state_is_served_by_one_poll(make_handler):
+    engine = fake_ovirt.FakeEngine(vm_count=3)
+    handler = make_handler(engine)
+    vm_ids = list(engine.vms)
+
+    states = [handler.wait_for_vm_state(vm_id, ["up"], 10) for vm_id in vm_ids]
+    missing = handler.wait_for_vm_state("no-such-vm", [ABSENT], 10)
+
+    assert states == ["up"] * 3
+    assert missing == ABSENT
+
+
+def test_watcher_keeps_polling_after_an_unexpected_error(make_handler):
+    engine = fake_ovirt.FakeEngine(vm_count=1)
+    handler = make_handler(engine)
+    vm_id, = engine.vms
+    # Not an sdk.Error, so it used to end the polling thread and strand the
+    # waiter until its timeout
+    engine.fail_next("vms.list", RuntimeError("connection reset"))
+
+    state = handler.wait_for_vm_state(vm_id, ["up"], 10)
+
+    assert state == "up"
+    assert engine.calls["vms.list"] == 2
@@ -0,0 +1,180 @@
+"""
+Client-side protection for RHEV-M against being overwhelmed by CloudBolt.
+
+Every call a handler makes to an endpoint passes through that endpoint's
+EndpointGuard, which limits the request rate with a token bucket, caps the
+number of requests in flight, and stops sending requests at all for a while
+(the circuit breaker) once the engine has failed several in a row.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from utilities.exceptions import CloudBoltException
+from utilities.logger import ThreadLogger
+
+from .lazy_sdk import sdk
+
+logger = ThreadLogger(__name__)
+
+
+class CircuitOpenError(CloudBoltException):
+    """
+    Raised instead of sending a request to an engine that is failing.
+    """
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` acquisitions per second on average, with bursts of up to
+    `burst`.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated = time.time()
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available.
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker(object):
+    """
+    Opens after `failure_threshold` consecutive failures, rejecting calls for
+    `reset_timeout` seconds. After that a single probe call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+
+    def before_call(self, name):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if (self.state == self.OPEN
+                    and time.time() - self._opened_at >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                logger.info("Probing RHEV-M at {0} after failures".format(name))
+                return
+            raise CircuitOpenError(
+                "Not calling RHEV-M at {0}: it failed {1} times in a row and is "
+                "being given time to recover".format(name, self._failures))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self, name):
+        with self._lock:
+            self._failures += 1
+            if (self.state == self.HALF_OPEN
+                    or self._failures >= self.failure_threshold):
+                if self.state != self.OPEN:
+                    logger.info("Pausing calls to RHEV-M at {0} for {1} seconds "
+                                "after {2} failures".format(
+                                    name, self.reset_timeout, self._failures))
+                self.state = self.OPEN
+                self._opened_at = time.time()
+
+
+class EndpointGuard(object):
+    """
+    The rate limiter, in-flight cap and circuit breaker for one endpoint.
+    """
+
+    def __init__(self, name, rate, burst, max_in_flight, failure_threshold,
+                 reset_timeout):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def acquire(self):
+        """
+        Wait for a request's turn, or fail fast with CircuitOpenError if the
+        circuit is open. Every acquire() must be matched by one release()
+        once the engine has answered.
+        """
+        self.breaker.before_call(self.name)
+        self.bucket.acquire()
+        self._in_flight.acquire()
+
+    def release(self, error=None):
+        """
+        Give back the in-flight slot taken by acquire(), recording whether the
+        engine handled the request given the `error` it raised, if any.
+        """
+        self._in_flight.release()
+        if error is not None and is_engine_failure(error):
+            self.breaker.record_failure(self.name)
+        else:
+            self.breaker.record_success()
+
+    @contextmanager
+    def call(self):
+        """
+        Context manager around one request, between acquire() and release().
+        """
+        self.acquire()
+        try:
+            yield
+        except Exception as e:
+            self.release(e)
+            raise
+        self.release()
+
+
+def is_engine_failure(error):
+    """
+    Return whether `error` means the engine is unhealthy, as opposed to a
+    request it answered but refused (e.g. a 404 or a locked VM).
+    """
+    if isinstance(error, (sdk.ConnectionError, getattr(sdk, "TimeoutError", ()))):
+        return True
+    code = getattr(error, "code", None)
+    return code is not None and code >= 500
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_endpoint_guard(url, rate, burst, max_in_flight, failure_threshold,
+                       reset_timeout):
+    """
+    Return the guard for the RHEV-M at `url`, creating it on first use. The
+    first handler to use an endpoint decides its limits.
+    """
+    with _guards_lock:
+        guard = _guards.get(url)
+        if guard is None:
+            guard = _guards[url] = EndpointGuard(
+                url, rate, burst, max_in_flight, failure_threshold,
+                reset_timeout)
+        return guard
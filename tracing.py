@@ -0,0 +1,167 @@
+"""
+Wall-time trace spans for provisioning and deletion jobs.
+
+A span times a block of work along with the RHEV-M calls made in it and
+any retries. Spans opened while another is open on the same thread nest
+under it. When the outermost span of a traced handler method ends, the
+tree is logged to the job log as a breakdown. It is also kept, so that the
+handler's recent traces can be inspected from Python.
+"""
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from utilities.logger import ThreadLogger
+
+from .instrumentation import collect_calls
+
+logger = ThreadLogger(__name__)
+
+# Completed traces kept per handler
+MAX_TRACES = 100
+
+_local = threading.local()
+_children_lock = threading.Lock()
+
+
+class Span(object):
+    """
+    One timed block of work. `calls` counts the RHEV-M calls made in it,
+    including in its children, by operation name.
+    """
+
+    def __init__(self, name, **tags):
+        self.name = name
+        self.tags = tags
+        self.start = time.time()
+        self.duration = None
+        self.calls = {}
+        self.retries = 0
+        self.error = None
+        self.children = []
+
+    def add_retry(self):
+        self.retries += 1
+
+    def to_dict(self):
+        return dict(
+            name=self.name, tags=dict(self.tags), start=self.start,
+            duration=self.duration, calls=sum(self.calls.values()),
+            calls_by_op=dict(self.calls), retries=self.retries,
+            error=self.error,
+            children=[child.to_dict() for child in self.children])
+
+    def format(self, depth=0):
+        """
+        Return the lines of the breakdown of this span and its children
+        """
+        details = ["{0:.1f}s".format(self.duration or 0)]
+        calls = sum(self.calls.values())
+        details.append("{0} call{1}".format(calls, "" if calls == 1 else "s"))
+        if self.retries:
+            details.append("{0} {1}".format(
+                self.retries, "retry" if self.retries == 1 else "retries"))
+        if self.error:
+            details.append("failed with {0}".format(self.error))
+        lines = ["{0}{1}: {2}".format("  " * depth, self.name, ", ".join(details))]
+        for child in self.children:
+            lines.extend(child.format(depth + 1))
+        return lines
+
+
+def current_span():
+    """
+    Return the innermost span open on the current thread, or None
+    """
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def trace_span(name, **tags):
+    """
+    Context manager yielding a new Span, nested under the current thread's
+    current span if there is one.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    span = Span(name, **tags)
+    if stack:
+        with _children_lock:
+            stack[-1].children.append(span)
+    stack.append(span)
+    try:
+        with collect_calls() as span.calls:
+            yield span
+    except Exception as e:
+        span.error = type(e).__name__
+        raise
+    finally:
+        span.duration = time.time() - span.start
+        stack.pop()
+
+
+@contextmanager
+def adopting_span(span):
+    """
+    Context manager that makes spans opened by the current (worker) thread
+    nest under `span`, as returned by current_span() on the thread the work
+    is being done for. Pair it with instrumentation.sharing_collectors() so
+    that the worker's calls count towards `span` too.
+    """
+    previous = getattr(_local, "stack", None)
+    _local.stack = [span] if span is not None else []
+    try:
+        yield
+    finally:
+        _local.stack = previous
+
+
+def traced(name):
+    """
+    Decorator for handler methods taking a resource_id, which runs the
+    method in a span. If that span is the outermost one on the thread, it
+    is kept in the handler's traces when it ends, and its breakdown is
+    logged if the handler's `log_trace_breakdowns` is set.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(handler, resource_id, *args, **kwargs):
+            is_root = current_span() is None
+            span = None
+            try:
+                with trace_span(name, resource_id=resource_id) as span:
+                    return method(handler, resource_id, *args, **kwargs)
+            finally:
+                if is_root and span is not None:
+                    _finish_trace(handler, span)
+        return wrapper
+    return decorator
+
+
+def _finish_trace(handler, span):
+    get_traces(handler.id).append(span)
+    if handler.log_trace_breakdowns:
+        logger.info("Timing breakdown for resource {0}:".format(
+            span.tags["resource_id"]))
+        for line in span.format():
+            logger.info("  " + line)
+
+
+_traces = {}
+_traces_lock = threading.Lock()
+
+
+def get_traces(handler_id):
+    """
+    Return the deque of the last MAX_TRACES root spans completed for the
+    handler with primary key `handler_id`, oldest first.
+    """
+    with _traces_lock:
+        traces = _traces.get(handler_id)
+        if traces is None:
+            traces = _traces[handler_id] = deque(maxlen=MAX_TRACES)
+        return traces
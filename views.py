@@ -1,3 +1,5 @@
+from django.db.models import Prefetch
+
 from infrastructure.models import Environment
 from resourcehandlers.rhev.models import RhevOSBuildAttribute
 
@@ -12,14 +14,18 @@ def get_detail_tabs(handler, profile):
     tabs = get_basic_tabs(handler, profile)
 
     rh_envs = handler.environment_set.all().order_by('name')
-    templates = RhevOSBuildAttribute.objects.filter(resourcehandler=handler).exclude(template_name=None)
+    # Fetch the OS builds with the templates, and the environments of all of
+    # them in one more query, so the number of queries doesn't grow with the
+    # number of templates
+    templates = RhevOSBuildAttribute.objects.filter(
+        resourcehandler=handler).exclude(template_name=None).select_related(
+        'os_build').prefetch_related(Prefetch(
+            'os_build__environments',
+            queryset=Environment.objects.filter(id__in=rh_envs).order_by('name'),
+            to_attr='rh_envs'))
 
     for template in templates:
-        if template.os_build:
-            envs = template.os_build.environments.filter(id__in=rh_envs)
-        else:
-            envs = Environment.objects.none()
-        template.envs = envs
+        template.envs = template.os_build.rh_envs if template.os_build else []
 
     tabs.insert(1, ('Images', 'images', dict(template='resourcehandlers/tab-templates.html', context={
         'templates': templates, 'handler_can_discover_templates': True,
@@ -0,0 +1,152 @@
+"""
+Pools of pre-created, powered-off VMs for provisioning to hand out instead of
+cloning a template.
+
+Cloning copies the template's disks, which can take minutes. A WarmPool keeps
+VMs already cloned from each template and powered off; provisioning claims
+one by renaming and resizing it, and the pool is topped up again in the
+background. Pool VMs are recognised by their names, which are
+WARM_VM_PREFIX followed by the template id, and are left out of VM syncs.
+
+Every CloudBolt process shares the pools, so a VM is claimed by inserting its
+id into RhevWarmVmClaim, whose unique constraint lets only one process win.
+"""
+import threading
+from datetime import timedelta
+from uuid import uuid4
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from utilities.logger import ThreadLogger
+
+from .lazy_sdk import sdk, types
+from .throttling import CircuitOpenError
+
+logger = ThreadLogger(__name__)
+
+WARM_VM_PREFIX = "cbwarm-"
+
+# Age after which claim records are deleted. A claimed VM is renamed straight
+# away, so no listing can still offer it by then.
+CLAIM_RETENTION = timedelta(days=1)
+
+
+def is_warm_vm(vm_obj):
+    """
+    Return whether the SDK VM object is an unclaimed pool VM
+    """
+    return (vm_obj.name or "").startswith(WARM_VM_PREFIX)
+
+
+class WarmPool(object):
+    """
+    The warm VMs of one resource handler, by template and cluster
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (template id, cluster id) pairs with a refill running
+        self._refilling = set()
+
+    @staticmethod
+    def get_search(handler, template, cluster):
+        return "name={0}{1}-* and {2}".format(
+            WARM_VM_PREFIX, template.id, handler.get_cluster_query(cluster.name))
+
+    def claim(self, handler, template, cluster, vm_params, correlation_id):
+        """
+        Turn a powered-off pool VM of `template` in `cluster` into the VM
+        described by `vm_params`, an SDK VM carrying the new name, CPU and
+        memory. Return the VM's id, or None if there is no VM to hand out.
+        """
+        # import here to prevent circular import problem
+        from .models import RhevWarmVmClaim
+
+        vms_service = handler.system_service.vms_service()
+        search = "{0} and status=down".format(
+            self.get_search(handler, template, cluster))
+        for vm_obj in vms_service.list(search=search):
+            try:
+                with transaction.atomic():
+                    RhevWarmVmClaim.objects.create(vm_id=vm_obj.id)
+            except IntegrityError:
+                # Another thread or process got this VM first
+                continue
+
+            try:
+                vms_service.vm_service(vm_obj.id).update(
+                    vm_params, query=dict(correlation_id=correlation_id))
+            except sdk.Error as e:
+                logger.info("Could not claim warm VM {0}: {1}".format(
+                    vm_obj.name, e))
+                # Leave the VM in the pool for a later claim
+                RhevWarmVmClaim.objects.filter(vm_id=vm_obj.id).delete()
+                continue
+            except Exception:
+                RhevWarmVmClaim.objects.filter(vm_id=vm_obj.id).delete()
+                raise
+            logger.info("Claimed warm VM {0} as {1}".format(
+                vm_obj.name, vm_params.name))
+            return vm_obj.id
+        return None
+
+    def refill(self, handler, template, cluster, size):
+        """
+        Clone `template` in `cluster` in a background thread until it has
+        `size` pool VMs, unless a refill for it is already running.
+
+        Several CloudBolt processes refilling at once can overshoot `size`;
+        the extra VMs are handed out like any other.
+        """
+        key = (template.id, cluster.id)
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+
+        thread = threading.Thread(
+            target=self._refill, args=(handler, template, cluster, size, key),
+            name="rhev-warm-pool-{0}".format(template.name))
+        thread.daemon = True
+        thread.start()
+
+    def _refill(self, handler, template, cluster, size, key):
+        # import here to prevent circular import problem
+        from .models import RhevWarmVmClaim
+
+        try:
+            with handler.releasing_connections():
+                RhevWarmVmClaim.objects.filter(
+                    claimed_at__lt=timezone.now() - CLAIM_RETENTION).delete()
+                vms_service = handler.system_service.vms_service()
+                pooled = vms_service.list(
+                    search=self.get_search(handler, template, cluster))
+                for _ in range(size - len(pooled)):
+                    name = "{0}{1}-{2}".format(
+                        WARM_VM_PREFIX, template.id, uuid4().hex[:8])
+                    logger.info("Adding {0} to the warm pool for template {1}"
+                                .format(name, template.name))
+                    vms_service.add(types.Vm(
+                        name=name,
+                        cluster=types.Cluster(id=cluster.id),
+                        template=types.Template(id=template.id),
+                    ))
+        except (sdk.Error, CircuitOpenError) as e:
+            logger.info("Refilling the warm pool for template {0} failed: {1}"
+                        .format(template.name, e))
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+
+_warm_pools = {}
+_warm_pools_lock = threading.Lock()
+
+
+def get_warm_pool(handler_id):
+    with _warm_pools_lock:
+        pool = _warm_pools.get(handler_id)
+        if pool is None:
+            pool = _warm_pools[handler_id] = WarmPool()
+        return pool
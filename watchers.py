@@ -0,0 +1,205 @@
+"""
+Shared polling of VM status for everything waiting on a VM to change state.
+
+Rather than each caller polling its own VM in a loop, waiters register with
+the VmStatusWatcher for their RHEV-M, and a single background thread polls
+all watched VMs with one batched search per interval.
+"""
+import threading
+
+from utilities.logger import ThreadLogger
+
+from .instrumentation import CallStats, InstrumentedService
+from .lazy_sdk import sdk
+from .throttling import CircuitOpenError
+
+logger = ThreadLogger(__name__)
+
+# Pseudo-state reported for a watched VM that no longer exists on the engine
+ABSENT = "absent"
+
+# VM states in which the VM's disks are no longer locked and it can be started
+VM_UNLOCKED_STATES = ("down", "suspended", "paused", "powering_up", "up")
+
+
+class _Waiter(object):
+
+    def __init__(self, vm_id, states, callback):
+        self.vm_id = vm_id
+        self.states = frozenset(states)
+        self.callback = callback
+        self.state = None
+
+
+class VmStatusWatcher(object):
+    """
+    Tracks the VMs that callers are waiting on and wakes each caller once its
+    VM reaches one of the states it asked for.
+
+    The poll interval starts at `min_interval` seconds and grows by
+    `backoff` (up to `max_interval`) while nothing being watched changes
+    state; any state change or new waiter resets it.
+    """
+
+    def __init__(self, pool, guard=None, min_interval=2, max_interval=15,
+                 backoff=1.5, batch_size=100):
+        self.pool = pool
+        self.guard = guard
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.stats = CallStats()
+
+        self._cond = threading.Condition()
+        self._waiters = {}
+        self._last_states = {}
+        self._interval = min_interval
+        self._thread = None
+
+    def wait_for(self, vm_id, states, timeout):
+        """
+        Block until the VM with id `vm_id` is in one of `states` (status
+        values such as 'up' or 'down', or ABSENT), or until `timeout`
+        seconds have passed.
+
+        Return the state that was reached, or None on timeout.
+
+        The calling thread's pooled connection is given back first, so that
+        callers waiting here never hold the connections the polling thread
+        needs.
+        """
+        self.pool.release_current_thread()
+        event = threading.Event()
+        waiter = self.watch(vm_id, states, lambda state: event.set())
+        if not event.wait(max(timeout, 0)):
+            self.unwatch(waiter)
+        return waiter.state
+
+    def watch(self, vm_id, states, callback):
+        """
+        Register for the VM with id `vm_id` reaching one of `states`, without
+        blocking. `callback` is called from the polling thread with the state
+        reached. Return a handle that can be passed to unwatch().
+        """
+        waiter = _Waiter(vm_id, states, callback)
+        with self._cond:
+            self._waiters.setdefault(vm_id, []).append(waiter)
+            self._interval = self.min_interval
+            self._ensure_polling()
+            self._cond.notify()
+        return waiter
+
+    def unwatch(self, waiter):
+        """
+        Stop watching for `waiter`, e.g. because the caller gave up waiting.
+        """
+        with self._cond:
+            waiters = self._waiters.get(waiter.vm_id, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[waiter.vm_id]
+
+    def _ensure_polling(self):
+        """
+        Start the polling thread if it is not running. Must be called with
+        the lock held.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._poll_loop, name="rhev-status-watcher")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _poll_loop(self):
+        try:
+            while True:
+                with self._cond:
+                    if not self._waiters:
+                        self._thread = None
+                        self._last_states = {}
+                        return
+                    vm_ids = list(self._waiters)
+
+                try:
+                    states = self._fetch_states(vm_ids)
+                except (sdk.Error, CircuitOpenError) as e:
+                    logger.info("Error polling RHEV VM status: {0}".format(e))
+                    states = {}
+                except Exception as e:
+                    # This is the only thread polling for every waiter, so
+                    # anything else (e.g. the pool timing out or being
+                    # closed) is logged and retried after backing off too.
+                    # The connection may be broken, so give it back.
+                    logger.info("Unexpected error polling RHEV VM status: "
+                                "{0!r}".format(e))
+                    self.pool.release_current_thread()
+                    states = {}
+
+                with self._cond:
+                    changed = self._dispatch(states)
+                    if changed:
+                        self._interval = self.min_interval
+                    else:
+                        self._interval = min(self._interval * self.backoff,
+                                             self.max_interval)
+                    if self._waiters:
+                        self._cond.wait(self._interval)
+        finally:
+            self.pool.release_current_thread()
+
+    def _fetch_states(self, vm_ids):
+        """
+        Return a dict of status values for `vm_ids`, fetched with one search
+        per `batch_size` VMs. VMs missing from the results are reported as
+        ABSENT.
+        """
+        states = dict.fromkeys(vm_ids, ABSENT)
+        system_service = self.pool.get_for_current_thread().system_service()
+        vms_service = InstrumentedService(
+            system_service, self.stats, guard=self.guard).vms_service()
+        for start in range(0, len(vm_ids), self.batch_size):
+            batch = vm_ids[start:start + self.batch_size]
+            search = " or ".join("id={0}".format(vm_id) for vm_id in batch)
+            for vm in vms_service.list(search=search, max=len(batch)):
+                states[vm.id] = vm.status.value
+        return states
+
+    def _dispatch(self, states):
+        """
+        Wake the waiters whose VMs reached a target state. Return whether any
+        watched VM changed state since the last poll. Must be called with the
+        lock held.
+        """
+        changed = False
+        for vm_id, state in states.items():
+            if self._last_states.get(vm_id) != state:
+                changed = True
+                self._last_states[vm_id] = state
+            waiters = self._waiters.get(vm_id, [])
+            for waiter in list(waiters):
+                if state in waiter.states:
+                    waiter.state = state
+                    waiter.callback(state)
+                    waiters.remove(waiter)
+            if not waiters:
+                self._waiters.pop(vm_id, None)
+        return changed
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def get_vm_status_watcher(pool, guard=None):
+    """
+    Return the watcher for the RHEV-M behind connection pool `pool`, creating
+    it on first use. Its polls go through `guard`, the endpoint's
+    throttling.EndpointGuard, if given.
+    """
+    with _watchers_lock:
+        watcher = _watchers.get(pool)
+        if watcher is None:
+            watcher = _watchers[pool] = VmStatusWatcher(pool, guard)
+        return watcher